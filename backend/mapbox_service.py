@@ -4,16 +4,22 @@ Handles route calculation, real-time tracking, and navigation services
 """
 
 import os
-import json
+import orjson
+import msgpack
+import asyncio
+import struct
+import base64
+from urllib.parse import quote
+import hashlib
 import logging
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+import time
+from typing import List, Optional, Dict, Any, Tuple
+from cachetools import LRUCache, TTLCache
 from pydantic import BaseModel
-import redis
-from mapbox import Directions, Geocoder
-import requests
-from geojson import Point, Feature, LineString
+import redis.asyncio as aioredis
+import httpx
 import math
+import numpy as np
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -28,18 +34,91 @@ MAPBOX_ACCESS_TOKEN = os.getenv("MAPBOX_ACCESS_TOKEN")
 if not MAPBOX_ACCESS_TOKEN:
     raise ValueError("MAPBOX_ACCESS_TOKEN environment variable is required")
 
-# Initialize Mapbox clients
-directions_client = Directions(access_token=MAPBOX_ACCESS_TOKEN)
-geocoder_client = Geocoder(access_token=MAPBOX_ACCESS_TOKEN)
+# Cell size (degrees) of the grid used to index route vertices
+ROUTE_GRID_CELL_DEG = 0.01
 
-# Redis client for caching
+# Grid columns wrap at the antimeridian so +180 and -180 share a column
+ROUTE_GRID_COLUMNS = round(360 / ROUTE_GRID_CELL_DEG)
+
+# Route indexes are kept per delivery for as long as its navigation route lives in Redis
+ROUTE_INDEX_TTL = 3600
+
+# Resolution (degrees) of quantized coordinates in cached route geometries (~0.1 m)
+COORDINATE_SCALE = 1e-6
+
+# Maximum number of coordinates accepted by a single Directions API request
+MAX_DIRECTIONS_COORDINATES = 25
+
+# Short stream field names used for driver location history entries
+HISTORY_STREAM_FIELDS = (
+    ("lat", "latitude"),
+    ("lon", "longitude"),
+    ("h", "heading"),
+    ("s", "speed"),
+    ("a", "accuracy"),
+    ("alt", "altitude"),
+)
+
+# Above this latitude the on-route check uses exact Haversine instead of equirectangular
+EQUIRECTANGULAR_MAX_LAT_RAD = math.radians(80)
+
+# Numba is optional; is_location_on_route falls back to NumPy without it
 try:
-    redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True, socket_connect_timeout=1)
-    redis_client.ping()
-    logger.info("Redis connection established")
-except Exception as e:
-    logger.warning(f"Redis connection failed: {e}. Caching will be disabled.")
-    redis_client = None
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+def _on_route_kernel(lon0, lat0, cos_lat0, lons, lats, cos_lats, tolerance_meters):
+    """Return True as soon as any route vertex is within tolerance (radians in, cosines precomputed)"""
+    R = 6371000.0  # Earth's radius in meters
+    
+    if abs(lat0) <= EQUIRECTANGULAR_MAX_LAT_RAD:
+        # Squared equirectangular distance: sub-meter error at route-matching tolerances
+        tolerance_sq = (tolerance_meters / R) ** 2
+        for i in range(lons.shape[0]):
+            dlat = lats[i] - lat0
+            dlon = ((lons[i] - lon0 + math.pi) % (2 * math.pi) - math.pi) * cos_lat0
+            if dlat * dlat + dlon * dlon <= tolerance_sq:
+                return True
+        return False
+    
+    for i in range(lons.shape[0]):
+        dlat = lats[i] - lat0
+        dlon = (lons[i] - lon0 + math.pi) % (2 * math.pi) - math.pi
+        a = math.sin(dlat / 2) ** 2 + cos_lat0 * cos_lats[i] * math.sin(dlon / 2) ** 2
+        if 2 * R * math.asin(math.sqrt(min(a, 1.0))) <= tolerance_meters:
+            return True
+    return False
+
+if NUMBA_AVAILABLE:
+    _on_route_kernel = njit(cache=True, fastmath=True, boundscheck=False)(_on_route_kernel)
+
+def warm_route_kernel() -> None:
+    """Compile (or load from cache) the Numba on-route kernel so the first route check doesn't pay for it"""
+    if not NUMBA_AVAILABLE:
+        return
+    
+    vertices = np.zeros(1, dtype=np.float64)
+    _on_route_kernel(0.0, 0.0, 1.0, vertices, vertices, vertices + 1.0, 100.0)
+
+# Shared HTTP/2 client for all Mapbox REST endpoints; requests multiplex over pooled connections
+mapbox_http_client = httpx.AsyncClient(
+    base_url="https://api.mapbox.com",
+    params={"access_token": MAPBOX_ACCESS_TOKEN},
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=32, keepalive_expiry=60.0)
+)
+
+# Redis client for caching (connection is verified in MapboxService.init_redis)
+redis_client = aioredis.Redis(
+    host='localhost',
+    port=6379,
+    decode_responses=False,  # Payloads are msgpack/orjson bytes
+    socket_connect_timeout=1,
+    max_connections=50
+)
 
 class Coordinate(BaseModel):
     longitude: float
@@ -84,85 +163,207 @@ class NavigationProgress(BaseModel):
     current_step: Optional[Dict[str, Any]] = None
     timestamp: str
 
+def quantize_line_string(geometry: Dict[str, Any]) -> Dict[str, Any]:
+    """Encode LineString coordinates as base64 int32 offsets from the first vertex (CityJSON-style transform)"""
+    coords = np.asarray(geometry["coordinates"], dtype=np.float64).reshape(-1, 2)
+    if coords.shape[0] < 8:
+        # Short lines are smaller as plain JSON than with the transform header
+        return geometry
+    
+    translate = coords[0]
+    offsets = np.round((coords - translate) / COORDINATE_SCALE).astype("<i4")
+    return {
+        "type": geometry["type"],
+        "transform": {"scale": COORDINATE_SCALE, "translate": translate.tolist()},
+        "offsets": base64.b64encode(offsets.tobytes()).decode("ascii")
+    }
+
+def dequantize_line_string(geometry: Dict[str, Any]) -> Dict[str, Any]:
+    """Decode a LineString produced by quantize_line_string back to float coordinates"""
+    if "offsets" not in geometry:
+        return geometry
+    
+    transform = geometry["transform"]
+    offsets = np.frombuffer(base64.b64decode(geometry["offsets"]), dtype="<i4").reshape(-1, 2)
+    coords = offsets * transform["scale"] + np.asarray(transform["translate"])
+    return {"type": geometry["type"], "coordinates": np.round(coords, 6).tolist()}
+
+def map_line_strings(value: Any, transform) -> Any:
+    """Return a copy of value with every GeoJSON LineString replaced by transform(line_string)"""
+    if isinstance(value, dict):
+        if value.get("type") == "LineString":
+            return transform(value)
+        return {key: map_line_strings(item, transform) for key, item in value.items()}
+    if isinstance(value, list):
+        return [map_line_strings(item, transform) for item in value]
+    return value
+
 class MapboxService:
     def __init__(self):
-        self.directions = directions_client
-        self.geocoder = geocoder_client
         self.redis = redis_client
+        self.http = mapbox_http_client
+        # Route geometries converted to radian arrays plus a vertex grid, keyed by delivery ID
+        self._route_arrays = TTLCache(maxsize=10000, ttl=ROUTE_INDEX_TTL)
+        # In-process cache of forward/reverse geocoding results
+        self._geocode_cache = LRUCache(maxsize=10000)
+
+    async def init_redis(self) -> None:
+        """Verify the Redis connection at startup, disabling caching if unavailable"""
+        if not self.redis:
+            return
+        
+        try:
+            await self.redis.ping()
+            logger.info("Redis connection established")
+        except Exception as e:
+            logger.warning(f"Redis connection failed: {e}. Caching will be disabled.")
+            self.redis = None
+
+    async def close(self) -> None:
+        """Release pooled HTTP connections at application shutdown"""
+        await self.http.aclose()
+
+    def _route_coordinates(self, route_request: RouteRequest) -> List[Coordinate]:
+        """Return the ordered origin, waypoint and destination coordinates of a request"""
+        return [route_request.origin, *route_request.waypoints, route_request.destination]
+
+    def _route_cache_key(self, route_request: RouteRequest) -> str:
+        """Build a process-stable route cache key from coordinates quantized to ~10 m"""
+        quantized = [
+            int(round(value * 1e4))
+            for coord in self._route_coordinates(route_request)
+            for value in (coord.longitude, coord.latitude)
+        ]
+        digest = hashlib.blake2b(
+            struct.pack(f"<{len(quantized)}i", *quantized),
+            digest_size=16
+        ).hexdigest()
+        options = f"{int(route_request.steps)}{int(route_request.alternatives)}{route_request.overview}"
+        return f"route:{route_request.profile}:{options}:{digest}"
+
+    async def _get_cached_route_fields(self, route_request: RouteRequest) -> Optional[Dict[str, Any]]:
+        """Return cached RouteResponse fields for a request, or None on a cache miss"""
+        if not self.redis or len(self._route_coordinates(route_request)) > MAX_DIRECTIONS_COORDINATES:
+            return None
+        
+        cached_route = await self.redis.get(self._route_cache_key(route_request))
+        if not cached_route:
+            return None
+        
+        logger.info("Retrieved route from cache")
+        cached = map_line_strings(orjson.loads(cached_route), dequantize_line_string)
+        return self._route_fields(cached["route"], cached["alternatives"])
+
+    def _route_fields(self, main_route: Dict[str, Any], alternatives: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build RouteResponse fields for a successful Directions result"""
+        return {
+            "success": True,
+            "route": main_route,
+            "alternatives": alternatives,
+            "duration": main_route.get('duration'),
+            "distance": main_route.get('distance'),
+            "geometry": main_route.get('geometry')
+        }
+
+    async def _calculate_chunked_route(self, route_request: RouteRequest, coordinates: List[Coordinate]) -> RouteResponse:
+        """Split a route exceeding the Directions coordinate limit into overlapping chunks and stitch the results"""
+        step = MAX_DIRECTIONS_COORDINATES - 1
+        chunks = [coordinates[i:i + MAX_DIRECTIONS_COORDINATES] for i in range(0, len(coordinates) - 1, step)]
+        
+        # Each chunk goes through calculate_route so it is cached independently
+        results = await asyncio.gather(*(
+            self.calculate_route(route_request.model_copy(update={
+                "origin": chunk[0],
+                "destination": chunk[-1],
+                "waypoints": chunk[1:-1],
+                "alternatives": False
+            }))
+            for chunk in chunks
+        ))
+        
+        for result in results:
+            if not result.success:
+                return RouteResponse(success=False, error=result.error)
+        
+        legs: List[Dict[str, Any]] = []
+        geometry_coords: List[List[float]] = []
+        for i, result in enumerate(results):
+            legs.extend((result.route or {}).get('legs', []))
+            if result.geometry:
+                # The first point of each later chunk repeats the previous chunk's last point
+                geometry_coords.extend(result.geometry['coordinates'][1 if i else 0:])
+        
+        geometry = {"type": "LineString", "coordinates": geometry_coords} if geometry_coords else None
+        duration = sum(result.duration or 0 for result in results)
+        distance = sum(result.distance or 0 for result in results)
+        
+        return RouteResponse.model_construct(
+            success=True,
+            route={"legs": legs, "geometry": geometry, "duration": duration, "distance": distance},
+            alternatives=[],
+            duration=duration,
+            distance=distance,
+            geometry=geometry
+        )
+
+    async def calculate_route_json(self, route_request: RouteRequest) -> bytes:
+        """Calculate a route and return the serialized RouteResponse; cache hits skip model construction"""
+        try:
+            cached_fields = await self._get_cached_route_fields(route_request)
+        except Exception as e:
+            logger.error(f"Error reading cached route: {str(e)}")
+            cached_fields = None
+        
+        if cached_fields:
+            return orjson.dumps({**cached_fields, "error": None})
         
-    async def calculate_route(self, route_request: RouteRequest) -> RouteResponse:
+        route_response = await self.calculate_route(route_request, use_cache=False)
+        return orjson.dumps(route_response.model_dump())
+
+    async def calculate_route(self, route_request: RouteRequest, use_cache: bool = True) -> RouteResponse:
         """Calculate a route between origin and destination with optional waypoints"""
         try:
-            # Build GeoJSON features list
-            features = []
+            coordinates = self._route_coordinates(route_request)
+            if len(coordinates) > MAX_DIRECTIONS_COORDINATES:
+                return await self._calculate_chunked_route(route_request, coordinates)
             
-            # Add origin
-            features.append({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [route_request.origin.longitude, route_request.origin.latitude]
-                }
-            })
-            
-            # Add waypoints if provided
-            for waypoint in route_request.waypoints:
-                features.append({
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [waypoint.longitude, waypoint.latitude]
-                    }
-                })
-            
-            # Add destination
-            features.append({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [route_request.destination.longitude, route_request.destination.latitude]
-                }
-            })
+            coords_path = ';'.join(f"{coord.longitude},{coord.latitude}" for coord in coordinates)
             
             # Check cache first
-            cache_key = f"route:{hash(str(features))}:{route_request.profile}"
-            if self.redis:
-                cached_route = self.redis.get(cache_key)
-                if cached_route:
-                    logger.info("Retrieved route from cache")
-                    return RouteResponse(**json.loads(cached_route))
+            if use_cache:
+                cached_fields = await self._get_cached_route_fields(route_request)
+                if cached_fields:
+                    # Cached payloads are written by us below, so skip re-validation
+                    return RouteResponse.model_construct(**cached_fields)
             
             # Make API request
-            response = self.directions.directions(
-                features=features,
-                profile=route_request.profile,
-                steps=route_request.steps,
-                alternatives=route_request.alternatives,
-                overview=route_request.overview,
-                geometries='geojson'
+            response = await self.http.get(
+                f"/directions/v5/{route_request.profile}/{coords_path}",
+                params={
+                    'steps': str(route_request.steps).lower(),
+                    'alternatives': str(route_request.alternatives).lower(),
+                    'overview': route_request.overview,
+                    'geometries': 'geojson'
+                }
             )
             
             if response.status_code == 200:
-                route_data = response.json()
+                route_data = orjson.loads(response.content)
                 
                 if route_data.get('routes'):
                     main_route = route_data['routes'][0]
-                    alternatives = route_data['routes'][1:] if len(route_data['routes']) > 1 else []
+                    alternatives = route_data['routes'][1:]
                     
-                    result = RouteResponse(
-                        success=True,
-                        route=main_route,
-                        alternatives=alternatives,
-                        duration=main_route.get('duration'),
-                        distance=main_route.get('distance'),
-                        geometry=main_route.get('geometry')
-                    )
-                    
-                    # Cache the result for 30 minutes
+                    # Cache the result for 30 minutes with quantized geometries
                     if self.redis:
-                        self.redis.setex(cache_key, 1800, result.json())
+                        cached = {"route": main_route, "alternatives": alternatives}
+                        await self.redis.setex(
+                            self._route_cache_key(route_request),
+                            1800,
+                            orjson.dumps(map_line_strings(cached, quantize_line_string))
+                        )
                     
-                    return result
+                    return RouteResponse.model_construct(**self._route_fields(main_route, alternatives))
                 else:
                     return RouteResponse(success=False, error="No routes found")
             else:
@@ -178,20 +379,15 @@ class MapboxService:
     async def optimize_multi_stop_route(self, coordinates: List[Coordinate], profile: str = "mapbox/driving-traffic") -> RouteResponse:
         """Optimize a route with multiple stops using Mapbox Optimization API"""
         try:
-            coords_list = [[coord.longitude, coord.latitude] for coord in coordinates]
-            
-            # Use Mapbox Optimization API (note: requires a different endpoint)
-            optimization_url = f"https://api.mapbox.com/optimized-trips/v1/{profile.replace('mapbox/', '')}"
+            coords_path = ';'.join(f"{coord.longitude},{coord.latitude}" for coord in coordinates)
             
             params = {
-                'coordinates': ';'.join([f"{coord[0]},{coord[1]}" for coord in coords_list]),
-                'access_token': MAPBOX_ACCESS_TOKEN,
                 'steps': 'true',
                 'geometries': 'geojson',
                 'overview': 'full'
             }
             
-            response = requests.get(optimization_url, params=params)
+            response = await self.http.get(f"/optimized-trips/v1/{profile}/{coords_path}", params=params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -218,16 +414,47 @@ class MapboxService:
             logger.error(error_msg)
             return RouteResponse(success=False, error=error_msg)
 
+    async def _get_cached_geocode(self, key: str) -> Optional[Any]:
+        """Look up a geocoding result in the local LRU, then in Redis"""
+        cached = self._geocode_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        if self.redis:
+            raw = await self.redis.get(key)
+            if raw:
+                cached = orjson.loads(raw)
+                self._geocode_cache[key] = cached
+                return cached
+        
+        return None
+
+    async def _store_cached_geocode(self, key: str, value: Any) -> None:
+        """Store a geocoding result in the local LRU and share it through Redis for 24 hours"""
+        self._geocode_cache[key] = value
+        if self.redis:
+            await self.redis.setex(key, 86400, orjson.dumps(value))
+
     async def geocode_address(self, address: str) -> Optional[Coordinate]:
         """Convert address to coordinates using Mapbox Geocoding API"""
         try:
-            response = self.geocoder.forward(address, limit=1)
+            address_hash = hashlib.blake2b(address.strip().lower().encode(), digest_size=16).hexdigest()
+            cache_key = f"geocode:{address_hash}"
+            cached = await self._get_cached_geocode(cache_key)
+            if cached is not None:
+                return Coordinate(longitude=cached[0], latitude=cached[1])
+            
+            response = await self.http.get(
+                f"/geocoding/v5/mapbox.places/{quote(address, safe='')}.json",
+                params={'limit': 1}
+            )
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('features'):
                     feature = data['features'][0]
                     coords = feature['geometry']['coordinates']
+                    await self._store_cached_geocode(cache_key, [coords[0], coords[1]])
                     return Coordinate(longitude=coords[0], latitude=coords[1])
             
             return None
@@ -236,20 +463,42 @@ class MapboxService:
             logger.error(f"Geocoding error: {str(e)}")
             return None
 
+    async def geocode_addresses(self, addresses: List[str], concurrency: int = 10) -> List[Optional[Coordinate]]:
+        """Geocode several addresses concurrently, returning results in input order"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def geocode_one(address: str) -> Optional[Coordinate]:
+            async with semaphore:
+                return await self.geocode_address(address)
+        
+        # Repeated addresses are resolved once
+        unique_addresses = list(dict.fromkeys(addresses))
+        results = await asyncio.gather(*(geocode_one(address) for address in unique_addresses))
+        by_address = dict(zip(unique_addresses, results))
+        
+        return [by_address[address] for address in addresses]
+
     async def reverse_geocode(self, coordinate: Coordinate) -> Optional[str]:
         """Convert coordinates to address using Mapbox Reverse Geocoding API"""
         try:
-            response = self.geocoder.reverse(
-                lon=coordinate.longitude,
-                lat=coordinate.latitude,
-                limit=1
+            # Quantize to 5 decimal places (~1 m) so nearby lookups share an entry
+            cache_key = f"reverse_geocode:{coordinate.longitude:.5f},{coordinate.latitude:.5f}"
+            cached = await self._get_cached_geocode(cache_key)
+            if cached is not None:
+                return cached
+            
+            response = await self.http.get(
+                f"/geocoding/v5/mapbox.places/{coordinate.longitude},{coordinate.latitude}.json",
+                params={'limit': 1}
             )
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('features'):
                     feature = data['features'][0]
-                    return feature.get('place_name', '')
+                    place_name = feature.get('place_name', '')
+                    await self._store_cached_geocode(cache_key, place_name)
+                    return place_name
             
             return None
             
@@ -285,44 +534,73 @@ class MapboxService:
         bearing = math.atan2(y, x)
         return (math.degrees(bearing) + 360) % 360
 
+    def _build_location_data(self, location: LocationUpdate, processed_at: Optional[int]) -> Dict[str, Any]:
+        """Create the enhanced location record stored for a driver"""
+        return {
+            "driver_id": location.driver_id,
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+            "heading": location.heading,
+            "speed": location.speed,
+            "accuracy": location.accuracy,
+            "altitude": location.altitude,
+            "timestamp": location.timestamp,
+            "processed_at": processed_at,  # Epoch microseconds
+            "geojson": {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [location.longitude, location.latitude]
+                },
+                "properties": {
+                    "driver_id": location.driver_id,
+                    "timestamp": location.timestamp,
+                    "heading": location.heading,
+                    "speed": location.speed,
+                    "accuracy": location.accuracy
+                }
+            }
+        }
+
+    def _queue_history_write(self, pipe, location: LocationUpdate, processed_at: int) -> None:
+        """Add the history stream entry for one update to a pipeline"""
+        history_key = f"driver_history_stream:{location.driver_id}"
+        
+        # History entries are flat stream fields; optional values are omitted when unset
+        history_fields = {"t": location.timestamp, "p": processed_at}
+        for field, attr in HISTORY_STREAM_FIELDS:
+            value = getattr(location, attr)
+            if value is not None:
+                history_fields[field] = value
+        
+        pipe.xadd(history_key, history_fields, maxlen=100, approximate=True)  # Keep ~last 100 locations
+
     async def store_location_update(self, location: LocationUpdate) -> bool:
         """Store driver location update in Redis"""
+        return await self.store_location_updates([location])
+
+    async def store_location_updates(self, locations: List[LocationUpdate]) -> bool:
+        """Store a batch of driver location updates in Redis in a single round-trip"""
         try:
             if not self.redis:
                 return False
-                
-            # Create enhanced location data
-            location_data = {
-                "driver_id": location.driver_id,
-                "latitude": location.latitude,
-                "longitude": location.longitude,
-                "heading": location.heading,
-                "speed": location.speed,
-                "accuracy": location.accuracy,
-                "altitude": location.altitude,
-                "timestamp": location.timestamp,
-                "processed_at": datetime.utcnow().isoformat(),
-                "geojson": Feature(
-                    geometry=Point((location.longitude, location.latitude)),
-                    properties={
-                        "driver_id": location.driver_id,
-                        "timestamp": location.timestamp,
-                        "heading": location.heading,
-                        "speed": location.speed,
-                        "accuracy": location.accuracy
-                    }
-                ).__geo_interface__
-            }
             
-            # Store in Redis with 5-minute expiry
-            redis_key = f"driver_location:{location.driver_id}"
-            self.redis.setex(redis_key, 300, json.dumps(location_data))
+            if not locations:
+                return True
+            
+            # Every update goes to history, but only each driver's newest one becomes the current location
+            latest: Dict[str, LocationUpdate] = {}
+            processed_at = time.time_ns() // 1000  # Epoch microseconds
+            pipe = self.redis.pipeline(transaction=False)
+            for location in locations:
+                self._queue_history_write(pipe, location, processed_at)
+                latest[location.driver_id] = location
             
-            # Also store in location history
-            history_key = f"driver_history:{location.driver_id}"
-            self.redis.lpush(history_key, json.dumps(location_data))
-            self.redis.ltrim(history_key, 0, 99)  # Keep last 100 locations
-            self.redis.expire(history_key, 3600)  # 1-hour expiry for history
+            for driver_id, location in latest.items():
+                payload = msgpack.packb(self._build_location_data(location, processed_at), use_bin_type=True)
+                pipe.setex(f"driver_location:{driver_id}", 300, payload)  # Current location with 5-minute expiry
+                pipe.expire(f"driver_history_stream:{driver_id}", 3600)  # 1-hour expiry for history
+            await pipe.execute()
             
             return True
             
@@ -337,10 +615,10 @@ class MapboxService:
                 return None
                 
             redis_key = f"driver_location:{driver_id}"
-            location_data = self.redis.get(redis_key)
+            location_data = await self.redis.get(redis_key)
             
             if location_data:
-                return json.loads(location_data)
+                return msgpack.unpackb(location_data, raw=False)
             
             return None
             
@@ -348,16 +626,52 @@ class MapboxService:
             logger.error(f"Error getting driver location: {str(e)}")
             return None
 
+    async def get_driver_locations(self, driver_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get current locations for several drivers with a single MGET"""
+        try:
+            if not self.redis or not driver_ids:
+                return {}
+            
+            keys = [f"driver_location:{driver_id}" for driver_id in driver_ids]
+            values = await self.redis.mget(keys)
+            
+            return {
+                driver_id: msgpack.unpackb(value, raw=False)
+                for driver_id, value in zip(driver_ids, values)
+                if value
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting driver locations: {str(e)}")
+            return {}
+
     async def get_driver_location_history(self, driver_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get driver location history from Redis"""
+        """Get driver location history (newest first) from Redis, as the same records get_driver_location returns"""
         try:
             if not self.redis:
                 return []
                 
-            history_key = f"driver_history:{driver_id}"
-            history_data = self.redis.lrange(history_key, 0, limit - 1)
+            history_key = f"driver_history_stream:{driver_id}"
+            entries = await self.redis.xrevrange(history_key, count=limit)
+            
+            history = []
+            for _, fields in entries:
+                timestamp = fields.get(b"t")
+                processed_at = fields.get(b"p")
+                values = {}
+                for field, attr in HISTORY_STREAM_FIELDS:
+                    value = fields.get(field.encode())
+                    values[attr] = float(value) if value is not None else None
+                
+                # Entries were validated on the way in, so rebuild them without re-validating
+                location = LocationUpdate.model_construct(
+                    driver_id=driver_id,
+                    timestamp=timestamp.decode() if timestamp else None,
+                    **values
+                )
+                history.append(self._build_location_data(location, int(processed_at) if processed_at else None))
             
-            return [json.loads(location) for location in history_data]
+            return history
             
         except Exception as e:
             logger.error(f"Error getting driver location history: {str(e)}")
@@ -388,22 +702,103 @@ class MapboxService:
             logger.error(f"Error calculating ETA: {str(e)}")
             return None
 
-    def is_location_on_route(self, current_location: Coordinate, route_geometry: Dict[str, Any], tolerance_meters: float = 100) -> bool:
-        """Check if current location is on the planned route within tolerance"""
+    def _route_index(self, route_geometry: Dict[str, Any], delivery_id: Optional[str] = None) -> Tuple[np.ndarray, ...]:
+        """Return per-route radian/cosine arrays and a vertex grid, cached by delivery ID when one is given"""
+        if delivery_id is not None:
+            cached = self._route_arrays.get(delivery_id)
+            if cached is not None:
+                return cached
+        
+        coords = np.asarray(route_geometry.get('coordinates', []), dtype=np.float64).reshape(-1, 2)
+        coords_rad = np.radians(coords)
+        lats = np.ascontiguousarray(coords_rad[:, 1])
+        
+        # Bucket vertex indices into a uniform lon/lat grid for local lookups
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        cell_indices = np.floor(coords / ROUTE_GRID_CELL_DEG).astype(np.int64)
+        cell_indices[:, 0] %= ROUTE_GRID_COLUMNS
+        for i, cell in enumerate(cell_indices.tolist()):
+            cells.setdefault((cell[0], cell[1]), []).append(i)
+        grid = {cell: np.asarray(indices, dtype=np.int64) for cell, indices in cells.items()}
+        
+        index = (np.ascontiguousarray(coords_rad[:, 0]), lats, np.cos(lats), grid)
+        if delivery_id is not None:
+            self._route_arrays[delivery_id] = index
+        
+        return index
+
+    def forget_route(self, delivery_id: str) -> None:
+        """Drop the cached index for a delivery's route when navigation restarts or the delivery completes"""
+        self._route_arrays.pop(delivery_id, None)
+
+    def _any_vertex_within(self, lon0: float, lat0: float, cos_lat0: float, lons: np.ndarray, lats: np.ndarray, cos_lats: np.ndarray, tolerance_meters: float) -> bool:
+        """Check whether any of the given vertices (radians) lies within tolerance of lon0/lat0"""
+        if NUMBA_AVAILABLE:
+            return bool(_on_route_kernel(lon0, lat0, cos_lat0, lons, lats, cos_lats, float(tolerance_meters)))
+        
+        R = 6371000  # Earth's radius in meters
+        dlat = lats - lat0
+        dlon = (lons - lon0 + math.pi) % (2 * math.pi) - math.pi
+        
+        # Squared equirectangular distance, compared without sqrt/atan2
+        approx_sq = dlat * dlat + (dlon * cos_lat0) ** 2
+        if abs(lat0) <= EQUIRECTANGULAR_MAX_LAT_RAD:
+            return bool((approx_sq <= (tolerance_meters / R) ** 2).any())
+        
+        # Near the poles only the latitude difference is a safe lower bound on distance
+        near = np.abs(dlat) <= tolerance_meters / R
+        if not near.any():
+            return False
+        
+        dlat, dlon = dlat[near], dlon[near]
+        a = np.sin(dlat / 2) ** 2 + cos_lat0 * cos_lats[near] * np.sin(dlon / 2) ** 2
+        distances = 2 * R * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        
+        return bool((distances <= tolerance_meters).any())
+
+    def is_location_on_route(self, current_location: Coordinate, route_geometry: Dict[str, Any], tolerance_meters: float = 100, delivery_id: Optional[str] = None) -> bool:
+        """Check if current location is on the planned route within tolerance
+        
+        Pass the delivery ID to reuse the route's precomputed arrays across calls; the server
+        forgets them when navigation restarts or the delivery completes.
+        """
         try:
             if not route_geometry or route_geometry.get('type') != 'LineString':
                 return False
             
-            coordinates = route_geometry.get('coordinates', [])
+            lons, lats, cos_lats, grid = self._route_index(route_geometry, delivery_id)
+            if lons.shape[0] == 0:
+                return False
             
-            for route_coord in coordinates:
-                route_point = Coordinate(longitude=route_coord[0], latitude=route_coord[1])
-                distance = self.calculate_distance(current_location, route_point)
+            lat0 = math.radians(current_location.latitude)
+            lon0 = math.radians(current_location.longitude)
+            cos_lat0 = math.cos(lat0)
+            
+            # Only vertices in grid cells overlapping the tolerance window can match. Columns
+            # narrow toward the poles, so size the x reach at the window's most poleward latitude;
+            # a window that reaches a pole covers every longitude and scans the whole route.
+            cell_meters = math.radians(ROUTE_GRID_CELL_DEG) * 6371000
+            reach_y = math.ceil(tolerance_meters / cell_meters)
+            max_lat = abs(current_location.latitude) + math.degrees(tolerance_meters / 6371000)
+            reach_x = math.ceil(tolerance_meters / (cell_meters * math.cos(math.radians(max_lat)))) if max_lat < 90 else None
+            
+            if reach_x is not None and (2 * reach_x + 1) * (2 * reach_y + 1) < len(grid):
+                cx = math.floor(current_location.longitude / ROUTE_GRID_CELL_DEG)
+                cy = math.floor(current_location.latitude / ROUTE_GRID_CELL_DEG)
+                columns = {x % ROUTE_GRID_COLUMNS for x in range(cx - reach_x, cx + reach_x + 1)}
+                candidates = [
+                    grid[(x, y)]
+                    for x in columns
+                    for y in range(cy - reach_y, cy + reach_y + 1)
+                    if (x, y) in grid
+                ]
+                if not candidates:
+                    return False
                 
-                if distance <= tolerance_meters:
-                    return True
+                indices = np.concatenate(candidates)
+                lons, lats, cos_lats = lons[indices], lats[indices], cos_lats[indices]
             
-            return False
+            return self._any_vertex_within(lon0, lat0, cos_lat0, lons, lats, cos_lats, tolerance_meters)
             
         except Exception as e:
             logger.error(f"Error checking location on route: {str(e)}")
@@ -416,11 +811,11 @@ class MapboxService:
                 return False
                 
             progress_key = f"navigation_progress:{progress.delivery_id}"
-            progress_data = progress.dict()
-            progress_data["updated_at"] = datetime.utcnow().isoformat()
+            progress_data = progress.model_dump()
+            progress_data["updated_at"] = time.time_ns() // 1000  # Epoch microseconds
             
             # Store with 10-minute expiry
-            self.redis.setex(progress_key, 600, json.dumps(progress_data))
+            await self.redis.setex(progress_key, 600, msgpack.packb(progress_data, use_bin_type=True))
             
             return True
             
@@ -435,10 +830,10 @@ class MapboxService:
                 return None
                 
             progress_key = f"navigation_progress:{delivery_id}"
-            progress_data = self.redis.get(progress_key)
+            progress_data = await self.redis.get(progress_key)
             
             if progress_data:
-                return json.loads(progress_data)
+                return msgpack.unpackb(progress_data, raw=False)
             
             return None
             
@@ -446,5 +841,24 @@ class MapboxService:
             logger.error(f"Error getting navigation progress: {str(e)}")
             return None
 
+    async def get_navigation_progresses(self, delivery_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get navigation progress for several deliveries with a single MGET"""
+        try:
+            if not self.redis or not delivery_ids:
+                return {}
+            
+            keys = [f"navigation_progress:{delivery_id}" for delivery_id in delivery_ids]
+            values = await self.redis.mget(keys)
+            
+            return {
+                delivery_id: msgpack.unpackb(value, raw=False)
+                for delivery_id, value in zip(delivery_ids, values)
+                if value
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting navigation progress: {str(e)}")
+            return {}
+
 # Initialize the service
 mapbox_service = MapboxService()
\ No newline at end of file
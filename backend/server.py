@@ -1,25 +1,32 @@
 import os
 import uuid
-import json
+import orjson
+import msgpack
 import secrets
 import hashlib
+import hmac
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set
 import asyncio
+import inspect
 import logging
+from collections import deque
 
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, status
+from fastapi import FastAPI, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect, BackgroundTasks, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel, EmailStr
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict, EmailStr
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 from passlib.context import CryptContext
-from jose import JWTError, jwt
-import redis
+import jwt
+from cachetools import TLRUCache, TTLCache
+import redis.asyncio as aioredis
 
 # Import Mapbox service
-from mapbox_service import mapbox_service, RouteRequest, LocationUpdate, NavigationProgress, Coordinate
+from mapbox_service import mapbox_service, warm_route_kernel, RouteRequest, LocationUpdate, NavigationProgress, Coordinate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,17 +35,23 @@ logger = logging.getLogger(__name__)
 # Environment variables
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("DB_NAME", "delivery_dispatch")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+
+# Shared PyJWT codec; HS256 goes through the cryptography backend's HMAC
+jwt_codec = jwt.PyJWT()
 
 # Initialize FastAPI app
-app = FastAPI(title="Delivery Driver Dispatch API", version="1.0.0")
+app = FastAPI(title="Delivery Driver Dispatch API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -46,26 +59,111 @@ app.add_middleware(
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Argon2id for new hashes; bcrypt hashes still verify and are upgraded on next login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
+# Password hashing runs in worker threads, at most one per CPU at a time
+password_hash_semaphore = asyncio.Semaphore(os.cpu_count() or 4)
+
+# Authenticated users keyed by SHA-256 of the bearer token; hits skip JWT decoding and the user lookup.
+# Entries live for AUTH_CACHE_TTL seconds but never past the token's own expiry.
+AUTH_CACHE_TTL = 30
+auth_cache = TLRUCache(maxsize=10000, ttu=lambda key, value, now: min(now + AUTH_CACHE_TTL, value[1]), timer=time.time)
+# Sharded locks so concurrent first requests with one token decode and look it up only once
+auth_locks = [asyncio.Lock() for _ in range(256)]
+# User documents keyed by user ID; shared by every token issued to the same user
+user_cache = TTLCache(maxsize=5000, ttl=300)
+# Driver documents keyed by driver ID, and the serialized active-driver list for the admin dashboard
+driver_cache = TTLCache(maxsize=5000, ttl=60)
+drivers_list_cache = TTLCache(maxsize=1, ttl=10)
+# Recently verified logins, keyed by an HMAC of the credentials and the stored hash they matched.
+# The key is random per process, so the cached digests cannot be brute-forced offline like a plain hash
+login_cache = TTLCache(maxsize=1000, ttl=5)
+LOGIN_CACHE_SECRET = os.urandom(32)
 
 # Database
-client = AsyncIOMotorClient(MONGO_URL)
+# Warm connections survive quiet periods; zstd compresses wire traffic when the server supports it
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    compressors="zstd"
+)
 db = client[DB_NAME]
 
-# Redis for real-time data
-try:
-    redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True, socket_connect_timeout=1)
-    redis_client.ping()
-    logger.info("Redis connection established")
-except Exception as e:
-    logger.warning(f"Redis connection failed: {e}")
-    redis_client = None
+# Redis for real-time data; connectivity is verified at startup
+redis_client = aioredis.Redis(host='localhost', port=6379, decode_responses=True, socket_connect_timeout=1)
+# Pub/sub location batches are msgpack, so the subscriber reads raw bytes on its own client
+pubsub_client = aioredis.Redis(host='localhost', port=6379, decode_responses=False, socket_connect_timeout=1)
+
+# Interval over which driver location updates are coalesced before fanout
+LOCATION_FLUSH_INTERVAL = 0.05
+# Outgoing messages buffered per customer socket before the oldest is dropped
+CUSTOMER_SEND_QUEUE_SIZE = 64
+# Location writes buffered between flushes; the oldest are dropped if Redis falls behind
+LOCATION_WRITE_BUFFER_SIZE = 10000
+ACTIVE_DELIVERY_STATUSES = ["assigned", "picked_up", "in_transit"]
+# Fields returned by the delivery list; internal bookkeeping fields stay in Mongo
+DELIVERY_LIST_FIELDS = [
+    "pickup_address", "pickup_latitude", "pickup_longitude",
+    "delivery_address", "delivery_latitude", "delivery_longitude",
+    "customer_name", "customer_phone", "customer_email", "notes",
+    "status", "driver_id", "driver_name", "tracking_id", "estimated_arrival",
+    "created_at", "updated_at", "assigned_at", "picked_up_at", "in_transit_at", "delivered_at"
+]
+# Projection for the delivery list: the listed fields plus _id renamed to id, server-side
+DELIVERY_LIST_PROJECTION = {"_id": 0, "id": {"$toString": "$_id"}, **{field: 1 for field in DELIVERY_LIST_FIELDS}}
+# Fields read by the public tracking endpoint
+TRACKING_INFO_FIELDS = [
+    "status", "driver_id", "estimated_arrival", "created_at", "updated_at",
+    "pickup_address", "pickup_latitude", "pickup_longitude",
+    "delivery_address", "delivery_latitude", "delivery_longitude"
+]
+# Pub/sub channels that carry driver locations and tracked-delivery changes to every worker
+LOCATION_CHANNEL = "driver_locations"
+DELIVERY_CHANNEL = "tracked_deliveries"
+LOCATION_CHANNEL_NAME = LOCATION_CHANNEL.encode()
+# Background route optimization jobs; state lives in Redis, or here when Redis is unavailable
+ROUTE_JOB_TTL = 600
+route_jobs = TTLCache(maxsize=1000, ttl=ROUTE_JOB_TTL)
+route_job_tasks: Set[asyncio.Task] = set()
+# At most this many optimizations call Mapbox at once; further jobs wait, up to MAX_PENDING_ROUTE_JOBS in total
+route_job_semaphore = asyncio.Semaphore(4)
+MAX_PENDING_ROUTE_JOBS = 100
+# Delivery fields the customer broadcast needs; endpoints that change them return these to the manager
+TRACKED_DELIVERY_FIELDS = {"driver_id": 1, "tracking_id": 1, "status": 1, "estimated_arrival": 1}
+LOCATION_ERROR = {
+    "type": "location_error",
+    "message": "Failed to process location update"
+}
+LOCATION_ERROR_MESSAGE = orjson.dumps(LOCATION_ERROR).decode()
+LOCATION_ERROR_FRAME = msgpack.packb(LOCATION_ERROR)
 
 # WebSocket Connection Manager
 class ConnectionManager:
     def __init__(self):
         self.driver_connections: Dict[str, WebSocket] = {}
-        self.customer_connections: Dict[str, WebSocket] = {}
+        # Every open tracking page per tracking ID; a link can be viewed from several devices
+        self.customer_connections: Dict[str, Set[WebSocket]] = {}
+        # Bounded outbox and writer task per customer socket so a slow client cannot stall fanout
+        self.customer_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.customer_writers: Dict[WebSocket, asyncio.Task] = {}
+        # Reverse map so a socket can be removed without knowing its tracking ID
+        self.customer_tracking_ids: Dict[WebSocket, str] = {}
+        # Deliveries with a connected customer, and the active ones indexed by driver for the broadcast
+        self.tracked_deliveries: Dict[str, dict] = {}
+        self.driver_trackings: Dict[str, Set[str]] = {}
+        # Latest encoded location per driver awaiting fanout; newer points overwrite older ones
+        self.pending_locations: Dict[str, bytes] = {}
+        # Location updates awaiting a single pipelined Redis write
+        self.pending_writes: deque = deque(maxlen=LOCATION_WRITE_BUFFER_SIZE)
+        self.flush_task: Optional[asyncio.Task] = None
+        self.subscriber_task: Optional[asyncio.Task] = None
 
     async def connect_driver(self, websocket: WebSocket, driver_id: str):
         await websocket.accept()
@@ -74,41 +172,211 @@ class ConnectionManager:
 
     async def connect_customer(self, websocket: WebSocket, tracking_id: str):
         await websocket.accept()
-        self.customer_connections[tracking_id] = websocket
+        self.customer_connections.setdefault(tracking_id, set()).add(websocket)
+        self.customer_tracking_ids[websocket] = tracking_id
+        queue = asyncio.Queue(maxsize=CUSTOMER_SEND_QUEUE_SIZE)
+        self.customer_queues[websocket] = queue
+        self.customer_writers[websocket] = asyncio.create_task(self.customer_writer(websocket, tracking_id, queue))
         logger.info(f"Customer tracking {tracking_id} connected")
 
-    def disconnect_driver(self, driver_id: str):
-        if driver_id in self.driver_connections:
+    def disconnect_driver(self, driver_id: str, websocket: WebSocket):
+        # A reconnect may already have replaced this socket; leave the newer one registered
+        if self.driver_connections.get(driver_id) is websocket:
             del self.driver_connections[driver_id]
             logger.info(f"Driver {driver_id} disconnected")
 
-    def disconnect_customer(self, tracking_id: str):
-        if tracking_id in self.customer_connections:
-            del self.customer_connections[tracking_id]
+    def disconnect_customer(self, websocket: WebSocket):
+        tracking_id = self.customer_tracking_ids.pop(websocket, None)
+        if tracking_id is not None:
+            viewers = self.customer_connections.get(tracking_id)
+            if viewers:
+                viewers.discard(websocket)
+                if not viewers:
+                    del self.customer_connections[tracking_id]
+                    self.untrack_delivery(tracking_id)
+            self.customer_queues.pop(websocket, None)
+            writer = self.customer_writers.pop(websocket, None)
+            if writer and writer is not asyncio.current_task():
+                writer.cancel()
             logger.info(f"Customer tracking {tracking_id} disconnected")
 
-    async def broadcast_to_customers(self, driver_id: str, location_data: dict):
-        # Find deliveries for this driver
-        active_deliveries = await db.deliveries.find({"driver_id": driver_id, "status": {"$in": ["assigned", "picked_up", "in_transit"]}}).to_list(None)
+    def track_delivery(self, delivery: Optional[dict]):
+        """Index or refresh a delivery that has connected customers"""
+        if not delivery:
+            return
+        tracking_id = delivery.get("tracking_id")
+        if tracking_id not in self.customer_connections:
+            return
         
-        for delivery in active_deliveries:
-            tracking_id = delivery.get("tracking_id")
-            if tracking_id and tracking_id in self.customer_connections:
+        self.untrack_delivery(tracking_id)
+        driver_id = delivery.get("driver_id")
+        self.tracked_deliveries[tracking_id] = {
+            "delivery_id": str(delivery["_id"]),
+            "driver_id": driver_id,
+            "estimated_arrival": delivery.get("estimated_arrival")
+        }
+        if driver_id and delivery.get("status") in ACTIVE_DELIVERY_STATUSES:
+            self.driver_trackings.setdefault(driver_id, set()).add(tracking_id)
+
+    def untrack_delivery(self, tracking_id: str):
+        tracked = self.tracked_deliveries.pop(tracking_id, None)
+        if tracked and tracked["driver_id"]:
+            trackings = self.driver_trackings.get(tracked["driver_id"])
+            if trackings:
+                trackings.discard(tracking_id)
+                if not trackings:
+                    del self.driver_trackings[tracked["driver_id"]]
+
+    def send_to_customer(self, websocket: WebSocket, message: str):
+        """Queue a message for a customer socket, dropping the oldest one when full"""
+        queue = self.customer_queues.get(websocket)
+        if queue is None:
+            return
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def customer_writer(self, websocket: WebSocket, tracking_id: str, queue: asyncio.Queue):
+        while True:
+            message = await queue.get()
+            try:
+                await websocket.send_text(message)
+            except Exception as e:
+                logger.error(f"Error broadcasting to customer {tracking_id}: {e}")
+                self.disconnect_customer(websocket)
+                return
+
+    def start(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_locations())
+        if self.subscriber_task is None and pubsub_client:
+            self.subscriber_task = asyncio.create_task(self.subscribe())
+
+    async def stop(self):
+        for task in (self.flush_task, self.subscriber_task):
+            if task:
+                task.cancel()
                 try:
-                    await self.customer_connections[tracking_id].send_text(json.dumps({
-                        "type": "location_update",
-                        "driver_location": location_data,
-                        "delivery_id": str(delivery["_id"]),
-                        "estimated_arrival": delivery.get("estimated_arrival")
-                    }))
-                except Exception as e:
-                    logger.error(f"Error broadcasting to customer {tracking_id}: {e}")
-                    self.disconnect_customer(tracking_id)
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.flush_task = None
+        self.subscriber_task = None
+        await self.flush_writes()
+
+    async def subscribe(self):
+        """Apply location and delivery updates published by any worker to this worker's customers"""
+        while True:
+            pubsub = pubsub_client.pubsub()
+            try:
+                await pubsub.subscribe(LOCATION_CHANNEL, DELIVERY_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if message["channel"] == LOCATION_CHANNEL_NAME:
+                        await self.broadcast_to_customers(self.decode_location_batch(message["data"]))
+                    else:
+                        self.track_delivery(orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pub/sub subscription error: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    @staticmethod
+    def encode_location_batch(locations: Dict[str, bytes]) -> bytes:
+        """Pack {driver_id: location JSON} as a msgpack map; the JSON travels as an opaque bin value"""
+        return msgpack.packb(locations, use_bin_type=True)
+
+    @staticmethod
+    def decode_location_batch(data: bytes) -> Dict[str, bytes]:
+        """Unpack a published batch without parsing the location JSON it carries"""
+        return msgpack.unpackb(data, raw=False)
+
+    async def publish_locations(self, locations: Dict[str, bytes]):
+        if not locations:
+            return
+        
+        # Each location was encoded once when queued and is reused verbatim by every worker and every recipient
+        if redis_client:
+            try:
+                await redis_client.publish(LOCATION_CHANNEL, self.encode_location_batch(locations))
+                return
+            except Exception as e:
+                logger.error(f"Error publishing driver locations: {str(e)}")
+        await self.broadcast_to_customers(locations)
+
+    async def publish_delivery(self, delivery: Optional[dict]):
+        """Share a tracked-delivery change with every worker, or apply it locally without Redis"""
+        if not delivery:
+            return
+        if redis_client:
+            try:
+                await redis_client.publish(DELIVERY_CHANNEL, orjson.dumps(delivery))
+                return
+            except Exception as e:
+                logger.error(f"Error publishing delivery update: {str(e)}")
+        self.track_delivery(delivery)
+
+    def queue_location(self, location_update: LocationUpdate):
+        """Buffer a driver location for the next Redis write and customer broadcast"""
+        # Encode the validated model, not the raw frame, so nothing unserializable reaches the shared flush
+        self.pending_writes.append(location_update)
+        self.pending_locations[location_update.driver_id] = orjson.dumps(location_update.model_dump(mode="json"))
+
+    async def flush_writes(self):
+        if not self.pending_writes:
+            return
+        
+        batch = list(self.pending_writes)
+        self.pending_writes.clear()
+        if not await mapbox_service.store_location_updates(batch):
+            logger.error(f"Dropped {len(batch)} buffered location updates")
+
+    async def flush_locations(self):
+        while True:
+            await asyncio.sleep(LOCATION_FLUSH_INTERVAL)
+            pending, self.pending_locations = self.pending_locations, {}
+            
+            # Customers need not wait on the Redis round-trip; persist and fan out concurrently
+            results = await asyncio.gather(
+                self.flush_writes(),
+                self.publish_locations(pending),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error flushing driver locations: {str(result)}")
+
+    async def broadcast_to_customers(self, locations: Dict[str, bytes]):
+        """Fan out pre-encoded driver location JSON to connected customers"""
+        # Sends are queued to each socket's writer task, so all customers are written to concurrently
+        for driver_id, location_json in locations.items():
+            tracking_ids = self.driver_trackings.get(driver_id)
+            if not tracking_ids:
+                continue
+            
+            # The encoded location is spliced into every delivery's payload as-is
+            location_fragment = orjson.Fragment(location_json)
+            for tracking_id in tracking_ids:
+                tracked = self.tracked_deliveries[tracking_id]
+                message = orjson.dumps({
+                    "type": "location_update",
+                    "driver_location": location_fragment,
+                    "delivery_id": tracked["delivery_id"],
+                    "estimated_arrival": tracked["estimated_arrival"]
+                }).decode()
+                for websocket in self.customer_connections.get(tracking_id, ()):
+                    self.send_to_customer(websocket, message)
 
 manager = ConnectionManager()
 
-# Pydantic models
+# Pydantic models; request bodies are read-only once validated
 class UserCreate(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     email: EmailStr
     password: str
     name: str
@@ -116,6 +384,8 @@ class UserCreate(BaseModel):
     role: str  # 'admin' or 'driver'
 
 class UserLogin(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     email: EmailStr
     password: str
 
@@ -127,6 +397,8 @@ class User(BaseModel):
     role: str
 
 class DeliveryCreate(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     pickup_address: Optional[str] = None
     pickup_latitude: Optional[float] = None
     pickup_longitude: Optional[float] = None
@@ -139,56 +411,158 @@ class DeliveryCreate(BaseModel):
     notes: Optional[str] = None
 
 class DeliveryAssign(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     driver_id: str
 
 class DeliveryUpdate(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     status: str  # 'assigned', 'picked_up', 'in_transit', 'delivered'
 
 class TrackingLinkCreate(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     customer_email: EmailStr
 
 # Utility functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_and_update_password(plain_password, hashed_password):
+    """Verify a password off the event loop, returning a replacement hash if the stored one is deprecated"""
+    async with password_hash_semaphore:
+        return await asyncio.to_thread(pwd_context.verify_and_update, plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    async with password_hash_semaphore:
+        return await asyncio.to_thread(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
+    now = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
+        expire = now + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt_codec.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def authenticate_token(token: str):
+    """Decode a bearer token and load its user, returning the user and the token's expiry"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt_codec.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        expires_at = payload.get("exp")
+        if user_id is None or expires_at is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"_id": user_id})
+    user = user_cache.get(user_id)
     if user is None:
-        raise credentials_exception
-    return user
+        user = await db.users.find_one({"_id": user_id})
+        if user is None:
+            raise credentials_exception
+        user_cache[user_id] = user
+    
+    return user, expires_at
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = auth_cache.get(cache_key)
+    if cached is not None:
+        return cached[0]
+    
+    async with auth_locks[cache_key[0]]:
+        cached = auth_cache.get(cache_key)
+        if cached is not None:
+            return cached[0]
+        
+        user, expires_at = await authenticate_token(token)
+        auth_cache[cache_key] = (user, expires_at)
+        return user
+
+async def get_driver(driver_id: str) -> Optional[dict]:
+    """Get a driver document, served from the driver cache when possible"""
+    driver = driver_cache.get(driver_id)
+    if driver is None:
+        driver = await db.users.find_one({"_id": driver_id, "role": "driver"}, {"password": 0, "password_hash": 0})
+        if driver is not None:
+            driver_cache[driver_id] = driver
+    return driver
+
+def generate_tracking_id() -> str:
+    """Generate a secure tracking ID (16 URL-safe characters, 96 random bits)"""
+    return secrets.token_urlsafe(12)
 
-def generate_tracking_id(delivery_id: str, customer_email: str) -> str:
-    """Generate a secure tracking ID"""
-    salt = secrets.token_hex(16)
-    data = f"{delivery_id}:{customer_email}:{salt}:{datetime.utcnow().timestamp()}"
-    tracking_hash = hashlib.sha256(data.encode()).hexdigest()
-    return tracking_hash[:16]
+async def init_redis():
+    """Verify the Redis connection, disabling Redis-backed metadata if unavailable"""
+    global redis_client, pubsub_client
+    try:
+        await redis_client.ping()
+        logger.info("Redis connection established")
+    except Exception as e:
+        logger.warning(f"Redis connection failed: {e}")
+        redis_client = None
+        pubsub_client = None
+
+async def run_redis_command(command: str, *args):
+    """Run a Redis command, awaiting its result whether or not the client is async"""
+    try:
+        result = getattr(redis_client, command)(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.error(f"Deferred Redis {command} failed: {str(e)}")
+
+def defer_redis_command(background_tasks: BackgroundTasks, command: str, *args):
+    """Run a Redis command after the response is sent"""
+    # BackgroundTasks runs sync callables in a thread and never awaits what they return, so client
+    # methods are never handed to it directly
+    background_tasks.add_task(run_redis_command, command, *args)
+
+async def ensure_indexes():
+    """Create indexes backing the queries issued by the API; each is created independently"""
+    indexes = [
+        (db.users, "email", {"unique": True}),
+        (db.users, [("role", 1), ("is_active", 1)], {}),
+        (db.deliveries, [("created_at", -1), ("_id", -1)], {}),
+        (db.deliveries, [("driver_id", 1), ("created_at", -1), ("_id", -1)], {}),
+        (db.deliveries, "tracking_id", {"unique": True, "sparse": True}),
+    ]
+    # One failure (e.g. duplicate emails blocking the unique index) must not skip the others
+    results = await asyncio.gather(
+        *(collection.create_index(keys, **options) for collection, keys, options in indexes),
+        return_exceptions=True
+    )
+    for (collection, keys, _), result in zip(indexes, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Index creation failed for {collection.name} {keys}: {result}")
+
+@app.on_event("startup")
+async def startup():
+    await init_redis()
+    await mapbox_service.init_redis()
+    await asyncio.to_thread(warm_route_kernel)
+    await ensure_indexes()
+    manager.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await manager.stop()
+    for task in route_job_tasks:
+        task.cancel()
+    await asyncio.gather(*route_job_tasks, return_exceptions=True)
+    await mapbox_service.close()
+    if redis_client:
+        await redis_client.aclose()
+    if pubsub_client:
+        await pubsub_client.aclose()
 
 # API Routes
 
@@ -198,7 +572,7 @@ async def root():
 
 @app.get("/api/health")
 async def health():
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return {"status": "healthy", "timestamp": datetime.utcnow()}
 
 # Authentication endpoints
 @app.post("/api/auth/register")
@@ -210,7 +584,7 @@ async def register(user: UserCreate):
     
     # Create user
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     
     user_doc = {
         "_id": user_id,
@@ -224,6 +598,8 @@ async def register(user: UserCreate):
     }
     
     await db.users.insert_one(user_doc)
+    if user.role == "driver":
+        drivers_list_cache.clear()
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -250,9 +626,26 @@ async def login(user: UserLogin):
     # Handle both password field names for backward compatibility
     stored_password = db_user.get("password") or db_user.get("password_hash") if db_user else None
     
-    if not db_user or not stored_password or not verify_password(user.password, stored_password):
+    if not db_user or not stored_password:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Repeated logins with the same credentials skip the deliberately slow hash for a few seconds;
+    # the stored hash is part of the key so a password change invalidates the entry
+    login_key = hmac.new(
+        LOGIN_CACHE_SECRET, f"{user.email}\0{user.password}\0{stored_password}".encode(), hashlib.sha256
+    ).digest()
+    if login_key in login_cache:
+        verified, new_hash = True, None
+    else:
+        verified, new_hash = await verify_and_update_password(user.password, stored_password)
+    if not verified:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    login_cache[login_key] = True
+    
+    if new_hash:
+        await db.users.update_one({"_id": db_user["_id"]}, {"$set": {"password": new_hash}, "$unset": {"password_hash": ""}})
+        user_cache.pop(str(db_user["_id"]), None)
+    
     if not db_user.get("is_active", True):
         raise HTTPException(status_code=401, detail="Account is disabled")
     
@@ -278,8 +671,8 @@ async def login(user: UserLogin):
 async def calculate_route(route_request: RouteRequest, current_user: dict = Depends(get_current_user)):
     """Calculate a route between origin and destination"""
     try:
-        route_response = await mapbox_service.calculate_route(route_request)
-        return route_response.dict()
+        route_json = await mapbox_service.calculate_route_json(route_request)
+        return Response(content=route_json, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Route calculation error: {str(e)}")
 
@@ -292,10 +685,72 @@ async def optimize_route(request: dict, current_user: dict = Depends(get_current
         
         coords = [Coordinate(**coord) for coord in coordinates]
         route_response = await mapbox_service.optimize_multi_stop_route(coords, profile)
-        return route_response.dict()
+        return route_response.model_dump()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Route optimization error: {str(e)}")
 
+async def store_route_job(job_id: str, job: dict):
+    """Persist route job state in Redis so any worker can answer polls, falling back to this process"""
+    if redis_client:
+        try:
+            await redis_client.setex(f"route_job:{job_id}", ROUTE_JOB_TTL, orjson.dumps(job))
+            return
+        except Exception as e:
+            logger.error(f"Error storing route job {job_id}: {str(e)}")
+    route_jobs[job_id] = job
+
+async def load_route_job(job_id: str) -> Optional[dict]:
+    if redis_client:
+        try:
+            job = await redis_client.get(f"route_job:{job_id}")
+            if job:
+                return orjson.loads(job)
+        except Exception as e:
+            logger.error(f"Error loading route job {job_id}: {str(e)}")
+    return route_jobs.get(job_id)
+
+async def run_route_optimization(job_id: str, user_id: str, coords: List[Coordinate], profile: str):
+    try:
+        async with route_job_semaphore:
+            route_response = await mapbox_service.optimize_multi_stop_route(coords, profile)
+        job = {"status": "completed", "user_id": user_id, "result": route_response.model_dump()}
+    except Exception as e:
+        job = {"status": "failed", "user_id": user_id, "error": str(e)}
+    await store_route_job(job_id, job)
+
+@app.post("/api/route/optimize/jobs", status_code=202)
+async def create_route_optimization_job(request: dict, current_user: dict = Depends(get_current_user)):
+    """Start a multi-stop route optimization in the background and return a job ID to poll"""
+    try:
+        coordinates = request.get("coordinates", [])
+        profile = request.get("profile", "mapbox/driving-traffic")
+        coords = [Coordinate(**coord) for coord in coordinates]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid coordinates: {str(e)}")
+    
+    if len(route_job_tasks) >= MAX_PENDING_ROUTE_JOBS:
+        raise HTTPException(status_code=503, detail="Too many route optimization jobs in progress, try again later")
+    
+    job_id = uuid.uuid4().hex
+    await store_route_job(job_id, {"status": "pending", "user_id": current_user["_id"]})
+    
+    # Keep a reference until the task finishes so it is not garbage collected mid-flight
+    task = asyncio.create_task(run_route_optimization(job_id, current_user["_id"], coords, profile))
+    route_job_tasks.add(task)
+    task.add_done_callback(route_job_tasks.discard)
+    
+    return {"job_id": job_id, "status": "pending"}
+
+@app.get("/api/route/jobs/{job_id}")
+async def get_route_optimization_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the status and, once completed, the result of a route optimization job"""
+    job = await load_route_job(job_id)
+    if not job or job.get("user_id") != current_user["_id"]:
+        raise HTTPException(status_code=404, detail="Route job not found")
+    
+    job.pop("user_id")
+    return {"job_id": job_id, **job}
+
 @app.post("/api/geocode")
 async def geocode_address(request: dict, current_user: dict = Depends(get_current_user)):
     """Convert address to coordinates"""
@@ -306,7 +761,7 @@ async def geocode_address(request: dict, current_user: dict = Depends(get_curren
             
         coordinate = await mapbox_service.geocode_address(address)
         if coordinate:
-            return {"success": True, "coordinate": coordinate.dict()}
+            return {"success": True, "coordinate": coordinate.model_dump()}
         else:
             return {"success": False, "error": "Address not found"}
     except Exception as e:
@@ -341,36 +796,40 @@ async def create_delivery(delivery: DeliveryCreate, current_user: dict = Depends
         pickup_lat, pickup_lng = delivery.pickup_latitude, delivery.pickup_longitude
         delivery_lat, delivery_lng = delivery.delivery_latitude, delivery.delivery_longitude
         
-        if delivery.pickup_address and (not pickup_lat or not pickup_lng):
-            pickup_coord = await mapbox_service.geocode_address(delivery.pickup_address)
-            if pickup_coord:
-                pickup_lat, pickup_lng = pickup_coord.latitude, pickup_coord.longitude
+        needs_pickup = bool(delivery.pickup_address and (not pickup_lat or not pickup_lng))
+        needs_delivery = bool(delivery.delivery_address and (not delivery_lat or not delivery_lng))
+        
+        # Resolve both addresses concurrently when both are missing coordinates
+        if needs_pickup and needs_delivery:
+            pickup_coord, delivery_coord = await mapbox_service.geocode_addresses(
+                [delivery.pickup_address, delivery.delivery_address]
+            )
+        else:
+            pickup_coord = await mapbox_service.geocode_address(delivery.pickup_address) if needs_pickup else None
+            delivery_coord = await mapbox_service.geocode_address(delivery.delivery_address) if needs_delivery else None
         
-        if delivery.delivery_address and (not delivery_lat or not delivery_lng):
-            delivery_coord = await mapbox_service.geocode_address(delivery.delivery_address)
-            if delivery_coord:
-                delivery_lat, delivery_lng = delivery_coord.latitude, delivery_coord.longitude
+        if pickup_coord:
+            pickup_lat, pickup_lng = pickup_coord.latitude, pickup_coord.longitude
+        if delivery_coord:
+            delivery_lat, delivery_lng = delivery_coord.latitude, delivery_coord.longitude
         
         if not all([pickup_lat, pickup_lng, delivery_lat, delivery_lng]):
             raise HTTPException(status_code=400, detail="Unable to resolve pickup or delivery location")
         
+        now = datetime.utcnow()
         delivery_id = str(uuid.uuid4())
+        # Unset optional fields are left out of the document rather than stored as null
         delivery_doc = {
             "_id": delivery_id,
-            "pickup_address": delivery.pickup_address,
+            **delivery.model_dump(exclude_none=True),
             "pickup_latitude": pickup_lat,
             "pickup_longitude": pickup_lng,
-            "delivery_address": delivery.delivery_address,
             "delivery_latitude": delivery_lat,
             "delivery_longitude": delivery_lng,
-            "customer_name": delivery.customer_name,
-            "customer_phone": delivery.customer_phone,
-            "customer_email": delivery.customer_email,
-            "notes": delivery.notes,
             "status": "pending",
             "created_by": current_user["_id"],
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "created_at": now,
+            "updated_at": now
         }
         
         await db.deliveries.insert_one(delivery_doc)
@@ -386,24 +845,45 @@ async def create_delivery(delivery: DeliveryCreate, current_user: dict = Depends
         raise HTTPException(status_code=500, detail=f"Error creating delivery: {str(e)}")
 
 @app.get("/api/deliveries")
-async def get_deliveries(current_user: dict = Depends(get_current_user)):
-    """Get deliveries based on user role"""
+async def get_deliveries(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get deliveries based on user role, newest first; all of them, or one page when limit is given"""
     try:
         if current_user["role"] == "admin":
             # Admin sees all deliveries
-            deliveries = await db.deliveries.find().sort([("created_at", -1)]).to_list(None)
+            query = {}
         elif current_user["role"] == "driver":
             # Driver sees only assigned deliveries
-            deliveries = await db.deliveries.find({"driver_id": current_user["_id"]}).sort([("created_at", -1)]).to_list(None)
+            query = {"driver_id": current_user["_id"]}
         else:
             raise HTTPException(status_code=403, detail="Invalid user role")
         
-        # Convert ObjectId to string for JSON serialization
-        for delivery in deliveries:
-            delivery["id"] = str(delivery["_id"])
-            del delivery["_id"]
+        # Keyset pagination on (created_at, _id): the next page starts strictly after the last row returned,
+        # so rows sharing a timestamp across a page boundary are neither skipped nor repeated
+        if before:
+            if before_id:
+                query["$or"] = [
+                    {"created_at": {"$lt": before}},
+                    {"created_at": before, "_id": {"$lt": before_id}}
+                ]
+            else:
+                query["created_at"] = {"$lt": before}
+        
+        pipeline = [{"$match": query}, {"$sort": {"created_at": -1, "_id": -1}}]
+        if limit:
+            pipeline.append({"$limit": limit})
+        # Mongo renames _id to id, so documents are returned exactly as they arrive
+        pipeline.append({"$project": DELIVERY_LIST_PROJECTION})
+        deliveries = await db.deliveries.aggregate(pipeline, batchSize=100).to_list(None)
         
-        return {"deliveries": deliveries}
+        next_before = next_before_id = None
+        if limit and len(deliveries) == limit:
+            next_before, next_before_id = deliveries[-1]["created_at"], deliveries[-1]["id"]
+        return ORJSONResponse({"deliveries": deliveries, "next_before": next_before, "next_before_id": next_before_id})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching deliveries: {str(e)}")
@@ -420,10 +900,9 @@ async def get_delivery(delivery_id: str, current_user: dict = Depends(get_curren
         if current_user["role"] == "driver" and delivery.get("driver_id") != current_user["_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
         
-        delivery["id"] = str(delivery["_id"])
-        del delivery["_id"]
+        delivery["id"] = str(delivery.pop("_id"))
         
-        return delivery
+        return ORJSONResponse(delivery)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching delivery: {str(e)}")
@@ -436,26 +915,30 @@ async def assign_delivery(delivery_id: str, assignment: DeliveryAssign, current_
     
     try:
         # Check if driver exists
-        driver = await db.users.find_one({"_id": assignment.driver_id, "role": "driver"})
+        driver = await get_driver(assignment.driver_id)
         if not driver:
             raise HTTPException(status_code=404, detail="Driver not found")
         
+        now = datetime.utcnow()
         # Update delivery
-        result = await db.deliveries.update_one(
+        updated = await db.deliveries.find_one_and_update(
             {"_id": delivery_id},
             {
                 "$set": {
                     "driver_id": assignment.driver_id,
                     "driver_name": driver["name"],
                     "status": "assigned",
-                    "assigned_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
+                    "assigned_at": now,
+                    "updated_at": now
                 }
-            }
+            },
+            projection=TRACKED_DELIVERY_FIELDS,
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.matched_count == 0:
+        if updated is None:
             raise HTTPException(status_code=404, detail="Delivery not found")
+        await manager.publish_delivery(updated)
         
         return {"message": "Delivery assigned successfully"}
         
@@ -466,30 +949,40 @@ async def assign_delivery(delivery_id: str, assignment: DeliveryAssign, current_
 async def update_delivery_status(delivery_id: str, status_update: DeliveryUpdate, current_user: dict = Depends(get_current_user)):
     """Update delivery status"""
     try:
-        delivery = await db.deliveries.find_one({"_id": delivery_id})
-        if not delivery:
-            raise HTTPException(status_code=404, detail="Delivery not found")
-        
-        # Check authorization
-        if current_user["role"] == "driver" and delivery.get("driver_id") != current_user["_id"]:
-            raise HTTPException(status_code=403, detail="Access denied")
-        elif current_user["role"] not in ["admin", "driver"]:
+        if current_user["role"] not in ["admin", "driver"]:
             raise HTTPException(status_code=403, detail="Invalid user role")
         
+        # Drivers may only update their own deliveries; the filter enforces it atomically
+        delivery_filter = {"_id": delivery_id}
+        if current_user["role"] == "driver":
+            delivery_filter["driver_id"] = current_user["_id"]
+        
+        now = datetime.utcnow()
         update_data = {
             "status": status_update.status,
-            "updated_at": datetime.utcnow()
+            "updated_at": now
         }
         
         # Add timestamp for specific status changes
         if status_update.status == "picked_up":
-            update_data["picked_up_at"] = datetime.utcnow()
+            update_data["picked_up_at"] = now
         elif status_update.status == "in_transit":
-            update_data["in_transit_at"] = datetime.utcnow()
+            update_data["in_transit_at"] = now
         elif status_update.status == "delivered":
-            update_data["delivered_at"] = datetime.utcnow()
+            update_data["delivered_at"] = now
         
-        await db.deliveries.update_one({"_id": delivery_id}, {"$set": update_data})
+        updated = await db.deliveries.find_one_and_update(
+            delivery_filter,
+            {"$set": update_data},
+            projection=TRACKED_DELIVERY_FIELDS,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            # Only reached on failure; tell a missing delivery apart from someone else's
+            if await db.deliveries.count_documents({"_id": delivery_id}, limit=1):
+                raise HTTPException(status_code=403, detail="Access denied")
+            raise HTTPException(status_code=404, detail="Delivery not found")
+        await manager.publish_delivery(updated)
         
         return {"message": "Delivery status updated successfully"}
         
@@ -498,39 +991,39 @@ async def update_delivery_status(delivery_id: str, status_update: DeliveryUpdate
 
 # Tracking endpoints
 @app.post("/api/deliveries/{delivery_id}/tracking")
-async def create_tracking_link(delivery_id: str, tracking_request: TrackingLinkCreate, current_user: dict = Depends(get_current_user)):
+async def create_tracking_link(delivery_id: str, tracking_request: TrackingLinkCreate, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     """Create a customer tracking link"""
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can create tracking links")
     
     try:
-        delivery = await db.deliveries.find_one({"_id": delivery_id})
-        if not delivery:
-            raise HTTPException(status_code=404, detail="Delivery not found")
-        
-        tracking_id = generate_tracking_id(delivery_id, tracking_request.customer_email)
+        now = datetime.utcnow()
+        tracking_id = generate_tracking_id()
         
         # Update delivery with tracking ID
-        await db.deliveries.update_one(
+        updated = await db.deliveries.find_one_and_update(
             {"_id": delivery_id},
             {
                 "$set": {
                     "tracking_id": tracking_id,
-                    "tracking_created_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
+                    "tracking_created_at": now,
+                    "updated_at": now
                 }
-            }
+            },
+            projection={"_id": 1}
         )
+        if updated is None:
+            raise HTTPException(status_code=404, detail="Delivery not found")
         
-        # Store tracking metadata in Redis if available
+        # Store tracking metadata in Redis after the response
         if redis_client:
             tracking_metadata = {
                 "delivery_id": delivery_id,
                 "customer_email": tracking_request.customer_email,
-                "created_at": datetime.utcnow().isoformat(),
-                "expires_at": (datetime.utcnow() + timedelta(days=7)).isoformat()
+                "created_at": now,
+                "expires_at": now + timedelta(days=7)
             }
-            redis_client.setex(f"tracking_meta:{tracking_id}", 604800, json.dumps(tracking_metadata))
+            defer_redis_command(background_tasks, "setex", f"tracking_meta:{tracking_id}", 604800, orjson.dumps(tracking_metadata))
         
         tracking_url = f"/track/{tracking_id}"
         return {
@@ -547,7 +1040,7 @@ async def get_tracking_info(tracking_id: str):
     """Get tracking information (public endpoint)"""
     try:
         # Find delivery by tracking ID
-        delivery = await db.deliveries.find_one({"tracking_id": tracking_id})
+        delivery = await db.deliveries.find_one({"tracking_id": tracking_id}, TRACKING_INFO_FIELDS)
         if not delivery:
             raise HTTPException(status_code=404, detail="Tracking link not found")
         
@@ -556,10 +1049,12 @@ async def get_tracking_info(tracking_id: str):
         navigation_progress = None
         
         if delivery.get("driver_id"):
-            driver_location = await mapbox_service.get_driver_location(delivery["driver_id"])
-            navigation_progress = await mapbox_service.get_navigation_progress(str(delivery["_id"]))
+            driver_location, navigation_progress = await asyncio.gather(
+                mapbox_service.get_driver_location(delivery["driver_id"]),
+                mapbox_service.get_navigation_progress(str(delivery["_id"]))
+            )
         
-        return {
+        return ORJSONResponse({
             "delivery_id": str(delivery["_id"]),
             "status": delivery["status"],
             "pickup_location": {
@@ -572,12 +1067,12 @@ async def get_tracking_info(tracking_id: str):
                 "latitude": delivery["delivery_latitude"],
                 "longitude": delivery["delivery_longitude"]
             },
-            "estimated_arrival": delivery.get("estimated_arrival").isoformat() if delivery.get("estimated_arrival") else None,
+            "estimated_arrival": delivery.get("estimated_arrival"),
             "driver_location": driver_location,
             "navigation_progress": navigation_progress,
-            "created_at": delivery["created_at"].isoformat(),
-            "updated_at": delivery["updated_at"].isoformat()
-        }
+            "created_at": delivery["created_at"],
+            "updated_at": delivery["updated_at"]
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting tracking info: {str(e)}")
@@ -596,10 +1091,10 @@ async def get_driver_location(driver_id: str, current_user: dict = Depends(get_c
         raise HTTPException(status_code=500, detail=f"Error getting driver location: {str(e)}")
 
 @app.post("/api/delivery/{delivery_id}/navigation/start")
-async def start_navigation(delivery_id: str, route_data: dict, current_user: dict = Depends(get_current_user)):
+async def start_navigation(delivery_id: str, route_data: dict, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     """Start navigation for a delivery"""
     try:
-        delivery = await db.deliveries.find_one({"_id": delivery_id})
+        delivery = await db.deliveries.find_one({"_id": delivery_id}, {"driver_id": 1})
         if not delivery:
             raise HTTPException(status_code=404, detail="Delivery not found")
         
@@ -607,21 +1102,27 @@ async def start_navigation(delivery_id: str, route_data: dict, current_user: dic
         if current_user["role"] == "driver" and delivery.get("driver_id") != current_user["_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
         
+        now = datetime.utcnow()
         # Update delivery status
-        await db.deliveries.update_one(
+        updated = await db.deliveries.find_one_and_update(
             {"_id": delivery_id},
             {
                 "$set": {
                     "status": "in_transit",
-                    "navigation_started_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
+                    "navigation_started_at": now,
+                    "updated_at": now
                 }
-            }
+            },
+            projection=TRACKED_DELIVERY_FIELDS,
+            return_document=ReturnDocument.AFTER
         )
+        await manager.publish_delivery(updated)
+        # A new route replaces any index built for the previous one
+        mapbox_service.forget_route(delivery_id)
         
         # Store route data in Redis if available
         if redis_client:
-            redis_client.setex(f"navigation_route:{delivery_id}", 3600, json.dumps(route_data))
+            defer_redis_command(background_tasks, "setex", f"navigation_route:{delivery_id}", 3600, orjson.dumps(route_data))
         
         return {"success": True, "message": "Navigation started"}
         
@@ -636,17 +1137,21 @@ async def update_navigation_progress(delivery_id: str, progress_data: dict, curr
         success = await mapbox_service.store_navigation_progress(progress)
         
         if success:
+            now = datetime.utcnow()
             # Update ETA in database
-            new_eta = datetime.utcnow() + timedelta(seconds=progress.duration_remaining)
-            await db.deliveries.update_one(
+            new_eta = now + timedelta(seconds=progress.duration_remaining)
+            updated = await db.deliveries.find_one_and_update(
                 {"_id": delivery_id},
                 {
                     "$set": {
                         "estimated_arrival": new_eta,
-                        "updated_at": datetime.utcnow()
+                        "updated_at": now
                     }
-                }
+                },
+                projection=TRACKED_DELIVERY_FIELDS,
+                return_document=ReturnDocument.AFTER
             )
+            await manager.publish_delivery(updated)
             
             return {"success": True, "message": "Progress updated"}
         else:
@@ -656,25 +1161,29 @@ async def update_navigation_progress(delivery_id: str, progress_data: dict, curr
         raise HTTPException(status_code=500, detail=f"Error updating progress: {str(e)}")
 
 @app.post("/api/delivery/{delivery_id}/complete")
-async def complete_delivery(delivery_id: str, current_user: dict = Depends(get_current_user)):
+async def complete_delivery(delivery_id: str, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     """Mark delivery as completed"""
     try:
+        now = datetime.utcnow()
         # Update delivery status
-        await db.deliveries.update_one(
+        updated = await db.deliveries.find_one_and_update(
             {"_id": delivery_id},
             {
                 "$set": {
                     "status": "delivered",
-                    "delivered_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
+                    "delivered_at": now,
+                    "updated_at": now
                 }
-            }
+            },
+            projection=TRACKED_DELIVERY_FIELDS,
+            return_document=ReturnDocument.AFTER
         )
+        await manager.publish_delivery(updated)
+        mapbox_service.forget_route(delivery_id)
         
         # Clean up Redis data
         if redis_client:
-            redis_client.delete(f"navigation_route:{delivery_id}")
-            redis_client.delete(f"navigation_progress:{delivery_id}")
+            defer_redis_command(background_tasks, "delete", f"navigation_route:{delivery_id}", f"navigation_progress:{delivery_id}")
         
         return {"success": True, "message": "Delivery completed"}
         
@@ -684,64 +1193,86 @@ async def complete_delivery(delivery_id: str, current_user: dict = Depends(get_c
 # WebSocket endpoints
 @app.websocket("/ws/driver/{driver_id}")
 async def driver_websocket(websocket: WebSocket, driver_id: str):
+    # Driver IDs key pub/sub batches and log lines; refuse any with control characters
+    if not driver_id.isprintable():
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
     await manager.connect_driver(websocket, driver_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            location_data = json.loads(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
             
-            # Create location update object
-            location_update = LocationUpdate(
-                driver_id=driver_id,
-                **location_data
-            )
+            # Binary frames are msgpack and are answered in msgpack; text frames stay JSON
+            binary = message.get("bytes") is not None
+            if binary:
+                location_data = msgpack.unpackb(message["bytes"], raw=False)
+            else:
+                location_data = orjson.loads(message["text"])
             
-            # Store location update
-            success = await mapbox_service.store_location_update(location_update)
+            # A frame carries one location or a batch of them
+            batch = location_data if isinstance(location_data, list) else [location_data]
+            location_updates = [LocationUpdate(driver_id=driver_id, **data) for data in batch]
             
-            if success:
-                # Broadcast to customers tracking this driver
-                await manager.broadcast_to_customers(driver_id, location_data)
+            if mapbox_service.redis:
+                # Queue for the next batched Redis write and coalesced broadcast to customers
+                for location_update in location_updates:
+                    manager.queue_location(location_update)
                 
-                # Send acknowledgment back to driver
-                await websocket.send_text(json.dumps({
+                # Send one acknowledgment per frame back to driver
+                ack = {
                     "type": "location_ack",
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "status": "processed"
-                }))
+                    "timestamp": datetime.utcnow(),
+                    "status": "processed",
+                    "count": len(location_updates)
+                }
+                if binary:
+                    ack["timestamp"] = ack["timestamp"].isoformat()
+                    await websocket.send_bytes(msgpack.packb(ack))
+                else:
+                    await websocket.send_text(orjson.dumps(ack).decode())
+            elif binary:
+                await websocket.send_bytes(LOCATION_ERROR_FRAME)
             else:
-                await websocket.send_text(json.dumps({
-                    "type": "location_error",
-                    "message": "Failed to process location update"
-                }))
+                await websocket.send_text(LOCATION_ERROR_MESSAGE)
                 
     except WebSocketDisconnect:
-        manager.disconnect_driver(driver_id)
+        pass
+    finally:
+        manager.disconnect_driver(driver_id, websocket)
 
 @app.websocket("/ws/customer/{tracking_id}")
 async def customer_websocket(websocket: WebSocket, tracking_id: str):
     await manager.connect_customer(websocket, tracking_id)
     try:
         # Send initial tracking data
-        delivery = await db.deliveries.find_one({"tracking_id": tracking_id})
+        delivery = await db.deliveries.find_one({"tracking_id": tracking_id}, TRACKED_DELIVERY_FIELDS)
+        manager.track_delivery(delivery)
         if delivery and delivery.get("driver_id"):
-            driver_location = await mapbox_service.get_driver_location(delivery["driver_id"])
-            navigation_progress = await mapbox_service.get_navigation_progress(str(delivery["_id"]))
+            driver_location, navigation_progress = await asyncio.gather(
+                mapbox_service.get_driver_location(delivery["driver_id"]),
+                mapbox_service.get_navigation_progress(str(delivery["_id"]))
+            )
             
             if driver_location or navigation_progress:
-                await websocket.send_text(json.dumps({
+                manager.send_to_customer(websocket, orjson.dumps({
                     "type": "initial_data",
                     "driver_location": driver_location,
                     "navigation_progress": navigation_progress,
                     "delivery_status": delivery["status"]
-                }))
+                }).decode())
         
-        # Keep connection alive
+        # Outbound only; wait for the disconnect without decoding anything the client sends
         while True:
-            await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
             
     except WebSocketDisconnect:
-        manager.disconnect_customer(tracking_id)
+        pass
+    finally:
+        manager.disconnect_customer(websocket)
 
 # Driver management endpoints
 @app.get("/api/drivers")
@@ -751,19 +1282,23 @@ async def get_drivers(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Only admins can access driver list")
     
     try:
-        drivers = await db.users.find({"role": "driver", "is_active": True}).to_list(None)
-        
-        # Remove sensitive information and convert ObjectId
-        for driver in drivers:
-            driver["id"] = str(driver["_id"])
-            del driver["_id"]
-            del driver["password"]
+        body = drivers_list_cache.get("drivers")
+        if body is None:
+            # Password hashes never leave Mongo, and _id is renamed to id server-side
+            drivers = await db.users.aggregate([
+                {"$match": {"role": "driver", "is_active": True}},
+                {"$addFields": {"id": {"$toString": "$_id"}}},
+                {"$project": {"_id": 0, "password": 0, "password_hash": 0}}
+            ]).to_list(None)
+            
+            body = orjson.dumps({"drivers": drivers})
+            drivers_list_cache["drivers"] = body
         
-        return {"drivers": drivers}
+        return Response(content=body, media_type="application/json")
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching drivers: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8001, loop="uvloop", http="httptools", ws_ping_interval=20, ws_ping_timeout=20)
\ No newline at end of file
@@ -8,19 +8,60 @@ and new Mapbox features: route calculation, geocoding, real-time tracking.
 
 import asyncio
 import aiohttp
-import json
-import websockets
+import httpx
+import orjson
+import msgpack
+from multidict import CIMultiDict, CIMultiDictProxy
+from websockets.asyncio.client import connect as ws_connect
 import uuid
+import time
+import math
+import operator
+import functools
+import argparse
+import statistics
+from collections import defaultdict, deque
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
 # Load environment variables
 load_dotenv('/app/frontend/.env')
 
 # Get the backend URL from frontend env
 BACKEND_URL = os.getenv('EXPO_PUBLIC_API_URL', 'http://localhost:8001')
-API_BASE = f"{BACKEND_URL}/api"
+WS_BASE = BACKEND_URL.replace('http', 'ws', 1)
+
+# Registration already returns tokens; only exercise /auth/login when asked to
+TEST_LOGIN_FLOW = os.getenv('TEST_LOGIN_FLOW', '0') == '1'
+
+# Parse bodies of status-only endpoints too (normally only the status code is checked)
+TEST_VERBOSE = os.getenv('TEST_VERBOSE', '0') == '1'
+
+# Optional file that receives the results as indented JSON
+TEST_RESULTS_PATH = os.getenv('TEST_RESULTS_PATH')
+
+# Optional file that keeps the registered users between runs so repeat runs skip registration
+TEST_TOKEN_CACHE = os.getenv('TEST_TOKEN_CACHE')
+
+# "httpx" (HTTP/2 where the server offers it), "h2c" (httpx with HTTP/2 prior knowledge, for plain-http
+# servers or proxies that speak cleartext HTTP/2) or "aiohttp" (HTTP/1.1 keep-alive pool).
+# httpx only negotiates HTTP/2 over TLS (ALPN), so by default plain-http backends use aiohttp
+HTTP_CLIENT = os.getenv('TEST_HTTP_CLIENT') or ('httpx' if BACKEND_URL.startswith('https://') else 'aiohttp')
+
+# "uvloop" (the default when installed) or "asyncio" to compare against the stock loop
+EVENT_LOOP = 'asyncio' if uvloop is None else os.getenv('TEST_EVENT_LOOP', 'uvloop')
 
 # Test coordinates (San Francisco area)
 SF_COORDINATES = {
@@ -29,65 +70,329 @@ SF_COORDINATES = {
     "waypoint": {"latitude": 37.7849, "longitude": -122.4294}   # Golden Gate Park area
 }
 
+# Socket URL and endpoint path templates, filled in with str.format
+WS_DRIVER_URL = WS_BASE + "/ws/driver/{}"
+WS_CUSTOMER_URL = WS_BASE + "/ws/customer/{}"
+ASSIGN_PATH = "/api/deliveries/{}/assign"
+STATUS_PATH = "/api/deliveries/{}/status"
+TRACKING_LINK_PATH = "/api/deliveries/{}/tracking"
+NAVIGATION_START_PATH = "/api/delivery/{}/navigation/start"
+PROGRESS_PATH = "/api/delivery/{}/progress"
+COMPLETE_PATH = "/api/delivery/{}/complete"
+TRACK_PATH = "/api/track/{}"
+DRIVER_LOCATION_PATH = "/api/driver/{}/location"
+# The admin listing only has to be non-empty, so one row is enough however many deliveries exist
+ADMIN_LISTING_PATH = "/api/deliveries?limit=1"
+
+# Request bodies that never change between runs, serialized once
+ROUTE_BODY = orjson.dumps({
+    "origin": SF_COORDINATES["pickup"],
+    "destination": SF_COORDINATES["delivery"],
+    "profile": "mapbox/driving-traffic",
+    "steps": True,
+    "alternatives": True
+})
+OPTIMIZE_BODY = orjson.dumps({
+    "coordinates": [
+        SF_COORDINATES["pickup"],
+        SF_COORDINATES["waypoint"],
+        SF_COORDINATES["delivery"]
+    ],
+    "profile": "mapbox/driving-traffic"
+})
+GEOCODE_BODY = orjson.dumps({"address": "Union Square, San Francisco, CA"})
+REVERSE_GEOCODE_BODY = orjson.dumps({"coordinate": SF_COORDINATES["pickup"]})
+DELIVERY_BODY = orjson.dumps({
+    "customer_name": "Sarah Johnson",
+    "customer_phone": "+1415555123",
+    "customer_email": "sarah.johnson@example.com",
+    "pickup_address": "Union Square, San Francisco, CA",
+    "delivery_address": "Fisherman's Wharf, San Francisco, CA",
+    "notes": "Handle with care - fragile electronics"
+})
+TRACKING_BODY = orjson.dumps({"customer_email": "sarah.johnson@example.com"})
+NAVIGATION_START_BODY = orjson.dumps({
+    "route_id": "test-route-123",
+    "estimated_duration": 1800,  # 30 minutes
+    "estimated_distance": 5000   # 5km
+})
+# Load-test delivery body; only the customer differs per virtual user, filled in with bytes %-formatting
+LOAD_DELIVERY_TEMPLATE = orjson.dumps({
+    "customer_name": "Load Test Customer %d",
+    "customer_phone": "+1415555123",
+    "customer_email": "load_%d@example.com",
+    "pickup_address": "Union Square, San Francisco, CA",
+    "pickup_latitude": SF_COORDINATES["pickup"]["latitude"],
+    "pickup_longitude": SF_COORDINATES["pickup"]["longitude"],
+    "delivery_address": "Fisherman's Wharf, San Francisco, CA",
+    "delivery_latitude": SF_COORDINATES["delivery"]["latitude"],
+    "delivery_longitude": SF_COORDINATES["delivery"]["longitude"]
+})
+INVALID_LOGIN_BODY = orjson.dumps({"email": "nonexistent@test.com", "password": "wrongpassword"})
+STATUS_BODIES = {status: orjson.dumps({"status": status}) for status in ("picked_up", "in_transit")}
+JSON_CONTENT_TYPE = {"Content-Type": "application/json"}
+ERROR_BODY_LIMIT = 512
+# Shared response predicate, built once instead of as a lambda per request
+SUCCEEDED = operator.methodcaller('get', 'success')
+# The server writes the customer snapshot with orjson, so its frame always starts with these bytes
+INITIAL_DATA_PREFIX = b'{"type":"initial_data"'
+
+# Simulated drivers only report a position once they have moved this far (meters)
+SHARE_RADIUS_M = 50
+TRIP_SAMPLES = 30
+LOAD_TRIP_SAMPLES = 100
+
+# Acks and initial tracking data are pushed immediately, so don't wait long for them
+WS_RECV_TIMEOUT = 2.0
+
+# Result line prefixes, encoded once for the buffered log
+PASSED_PREFIX = "✅ ".encode()
+FAILED_PREFIX = "❌ ".encode()
+
+class TestAborted(Exception):
+    """Raised by a fatal test failure so the tests that depend on it are skipped"""
+    __test__ = False
+
+
+class TestFailed(Exception):
+    """Raised inside a test method to fail the named check and end that test"""
+    __test__ = False
+
+    def __init__(self, test_name, message, fatal=False):
+        super().__init__(f"{test_name}: {message}")
+        self.test_name = test_name
+        self.message = message
+        self.fatal = fatal
+
+
+def _test_case(test):
+    """Log the TestFailed a test method raises instead of letting it escape"""
+    @functools.wraps(test)
+    async def run(self):
+        try:
+            await test(self)
+        except TestFailed as e:
+            self.log_result(e.test_name, False, e.message, e.fatal)
+    return run
+
+
 class DeliveryDispatchTester:
-    def __init__(self):
+    def __init__(self, json_summary=False, verbose=True):
+        self.json_summary = json_summary
+        self.verbose = verbose
         self.session = None
+        self.http2_client = None
+        self.loop = None
+        self.health_request = None
+        self.driver_ws = None
+        self.driver_ws_lock = asyncio.Lock()
+        self.driver_send_lock = asyncio.Lock()
+        self.driver_ack_reader = None
+        self.pending_acks = deque()
+        # Packed trip frames by sample count; every virtual user replays the same trip
+        self.trip_frames = {}
         self.admin_token = None
         self.driver_token = None
+        self.admin_headers = None
+        self.driver_headers = None
         self.admin_user = None
         self.driver_user = None
+        self.assignment_body = None
+        self.driver_location_path = None
         self.test_delivery_id = None
         self.tracking_id = None
-        self.results = {
-            'passed': 0,
-            'failed': 0,
-            'errors': []
-        }
-
-    async def setup_session(self):
-        """Setup HTTP session"""
-        self.session = aiohttp.ClientSession()
+        self.run_timestamp = None
+        self.progress_body = None
+        self.timings = defaultdict(list)
+        self._log_buf = []
+        # Plain attributes rather than a results dict; the failure count is len(errors)
+        self.passed = 0
+        self.errors = []
+
+    async def setup_session(self, limit=0, limit_per_host=64):
+        """Setup HTTP session with a pooled keep-alive connector"""
+        # Looked up once; every task and ack future of the run is created on this loop
+        self.loop = asyncio.get_running_loop()
+        # One ISO timestamp per run for every progress/location payload
+        self.run_timestamp = datetime.utcnow().isoformat()
+        self.progress_body = orjson.dumps({
+            "distance_remaining": 2500,
+            "duration_remaining": 900,
+            "fraction_traveled": 0.5,
+            "distance_traveled": 2500,
+            "timestamp": self.run_timestamp
+        })
+        if HTTP_CLIENT in ('httpx', 'h2c'):
+            # Over TLS (or h2c), concurrent requests are multiplexed as streams on a single connection
+            self.http2_client = httpx.AsyncClient(
+                base_url=BACKEND_URL,
+                http1=HTTP_CLIENT != 'h2c',
+                http2=True,
+                timeout=30,
+                headers=JSON_CONTENT_TYPE,
+                limits=httpx.Limits(
+                    max_connections=limit or 100,
+                    max_keepalive_connections=min(limit_per_host, 50),
+                    keepalive_expiry=75
+                )
+            )
+        else:
+            # Resolve BACKEND_URL once and keep it cached for the whole run
+            connector = aiohttp.TCPConnector(
+                resolver=aiohttp.AsyncResolver() if aiodns is not None else None,
+                use_dns_cache=True,
+                limit=limit,
+                limit_per_host=limit_per_host,
+                ttl_dns_cache=600,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True
+            )
+            self.session = aiohttp.ClientSession(
+                base_url=BACKEND_URL,
+                connector=connector,
+                headers=JSON_CONTENT_TYPE,
+                timeout=aiohttp.ClientTimeout(total=30, connect=5)
+            )
+        
+        # Start the health request now so DNS + TCP/TLS setup overlaps the rest of bring-up;
+        # test_health_check reaps its response instead of sending another request
+        self.health_request = self.loop.create_task(self._request("GET", "/api/health"))
 
     async def cleanup_session(self):
         """Cleanup HTTP session"""
+        if self.health_request is not None:
+            # The load test never reaps it
+            self.health_request.cancel()
+            await asyncio.gather(self.health_request, return_exceptions=True)
+        if self.driver_ws:
+            await self.driver_ws.close()
+        if self.driver_ack_reader:
+            await self.driver_ack_reader
         if self.session:
             await self.session.close()
-
-    def log_result(self, test_name, success, message=""):
-        """Log test result"""
+            # Let the connector's transports finish closing before the loop shuts down
+            await asyncio.sleep(0)
+        if self.http2_client:
+            await self.http2_client.aclose()
+
+    def log(self, line):
+        """Buffer an output line until flush_log"""
+        self._log_buf.append(f"{line}\n".encode())
+
+    def flush_log(self):
+        """Write all buffered output lines to stdout in one call"""
+        if self.verbose:
+            sys.stdout.flush()
+            sys.stdout.buffer.writelines(self._log_buf)
+            sys.stdout.buffer.flush()
+        self._log_buf.clear()
+
+    def log_result(self, test_name, success, message="", fatal=False):
+        """Log test result, aborting the run when a fatal test fails"""
         if success:
-            self.results['passed'] += 1
-            print(f"✅ {test_name}: PASSED {message}")
+            self.passed += 1
+            self._log_buf.append(PASSED_PREFIX + f"{test_name}: PASSED {message}\n".encode())
+        else:
+            # Formatted only when the summary is written
+            self.errors.append((test_name, message))
+            self._log_buf.append(FAILED_PREFIX + f"{test_name}: FAILED - {message}\n".encode())
+            if fatal:
+                raise TestAborted(test_name)
+
+    @staticmethod
+    def _auth_headers(token):
+        """Build a user's request headers once"""
+        # aiohttp copies plain dicts into a CIMultiDict on every request; a multidict is merged as is
+        return CIMultiDictProxy(CIMultiDict({"Authorization": f"Bearer {token}", "Accept": "application/json"}))
+
+    async def _request(self, method, path, headers=None, json_body=None, parse=True):
+        """Send a request and return the status with the parsed (or raw text) body"""
+        # Encode straight to bytes; both clients send the JSON content type by default
+        if json_body is not None and not isinstance(json_body, bytes):
+            json_body = orjson.dumps(json_body)
+        
+        if self.http2_client is not None:
+            response = await self.http2_client.request(method, path, content=json_body, headers=headers)
+            status, body = response.status_code, response.content
         else:
-            self.results['failed'] += 1
-            self.results['errors'].append(f"{test_name}: {message}")
-            print(f"❌ {test_name}: FAILED - {message}")
+            async with self.session.request(method, path, data=json_body, headers=headers) as response:
+                # Always drain the body so the connection goes back to the pool
+                status, body = response.status, await response.read()
+        
+        if status == 200:
+            return status, orjson.loads(body) if parse else None
+        # Error bodies are only echoed into log lines, so decode just their head
+        return status, body[:ERROR_BODY_LIMIT].decode("utf-8", "replace")
+
+    async def _do(self, test_name, method, path, headers=None, json_body=None, expect_keys=(), valid=None,
+                  status_only=False, fatal=False, pending=None):
+        """Run (or reap an already started) request and return the body, raising TestFailed on any failure"""
+        parse = TEST_VERBOSE or not status_only
+        try:
+            status, data = await (pending or self._request(method, path, headers, json_body, parse))
+            if status != 200:
+                raise TestFailed(test_name, f"Status: {status}, Response: {data}", fatal)
+            if not parse:
+                return {}
+            if any(key not in data for key in expect_keys) or (valid and not valid(data)):
+                raise TestFailed(test_name, f"Unexpected response: {data}", fatal)
+            return data
+        except TestFailed:
+            raise
+        except Exception as e:
+            raise TestFailed(test_name, f"Exception: {str(e)}", fatal) from e
 
+    async def _check(self, test_name, *args, **kwargs):
+        """Run _do and log the check as passed, for checks that report no detail"""
+        data = await self._do(test_name, *args, **kwargs)
+        self.log_result(test_name, True)
+        return data
+
+    @_test_case
     async def test_health_check(self):
         """Test health check endpoint"""
+        await self._check("Health Check", "GET", "/api/health", pending=self.health_request,
+                          valid=lambda d: d.get('status') == 'healthy', fatal=True)
+
+    def _set_users(self, admin, driver):
+        """Adopt the admin and driver registration bodies and derive the per-user request values"""
+        self.admin_token = admin['token']
+        self.admin_headers = self._auth_headers(self.admin_token)
+        self.admin_user = admin['user']
+        self.driver_token = driver['token']
+        self.driver_headers = self._auth_headers(self.driver_token)
+        self.driver_user = driver['user']
+        self.assignment_body = orjson.dumps({"driver_id": self.driver_user['id']})
+        self.driver_location_path = DRIVER_LOCATION_PATH.format(self.driver_user['id'])
+
+    async def _restore_users(self):
+        """Reuse the users cached by an earlier run if the server still accepts their tokens"""
         try:
-            async with self.session.get(f"{API_BASE}/health") as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('status') == 'healthy':
-                        self.log_result("Health Check", True)
-                        return True
-                    else:
-                        self.log_result("Health Check", False, f"Unexpected response: {data}")
-                        return False
-                else:
-                    self.log_result("Health Check", False, f"Status code: {response.status}")
-                    return False
-        except Exception as e:
-            self.log_result("Health Check", False, f"Exception: {str(e)}")
-            return False
-
+            with open(TEST_TOKEN_CACHE, 'rb') as f:
+                cached = orjson.loads(f.read())
+            admin, driver = cached['admin'], cached['driver']
+            # One cheap authenticated read per role stands in for a token check
+            statuses = await asyncio.gather(
+                self._request("GET", "/api/drivers", self._auth_headers(admin['token']), parse=False),
+                self._request("GET", ADMIN_LISTING_PATH, self._auth_headers(driver['token']), parse=False)
+            )
+        except Exception:
+            return False
+        if any(status != 200 for status, _ in statuses):
+            return False
+        self._set_users(admin, driver)
+        return True
+
+    @_test_case
     async def test_user_registration(self):
         """Test user registration for both admin and driver"""
+        if TEST_TOKEN_CACHE and await self._restore_users():
+            self.log_result("User Registration", True, f"Reused cached users from {TEST_TOKEN_CACHE}")
+            return
+
         # Use unique emails with timestamp to avoid conflicts
         timestamp = str(int(datetime.now().timestamp()))
         
-        # Test admin registration
         admin_data = {
             "email": f"admin_{timestamp}@deliveryapp.com",
             "name": "Admin User",
@@ -95,27 +400,6 @@ class DeliveryDispatchTester:
             "role": "admin",
             "password": "admin123"
         }
-        
-        try:
-            async with self.session.post(f"{API_BASE}/auth/register", json=admin_data) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'token' in data and 'user' in data:
-                        self.admin_token = data['token']
-                        self.admin_user = data['user']
-                        self.log_result("Admin Registration", True)
-                    else:
-                        self.log_result("Admin Registration", False, f"Missing token or user in response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Admin Registration", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Admin Registration", False, f"Exception: {str(e)}")
-            return False
-
-        # Test driver registration
         driver_data = {
             "email": f"driver_{timestamp}@deliveryapp.com",
             "name": "Driver User",
@@ -124,764 +408,576 @@ class DeliveryDispatchTester:
             "password": "driver123"
         }
         
-        try:
-            async with self.session.post(f"{API_BASE}/auth/register", json=driver_data) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'token' in data and 'user' in data:
-                        self.driver_token = data['token']
-                        self.driver_user = data['user']
-                        self.log_result("Driver Registration", True)
-                        return True
-                    else:
-                        self.log_result("Driver Registration", False, f"Missing token or user in response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Driver Registration", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Driver Registration", False, f"Exception: {str(e)}")
-            return False
+        # The two users are independent rows, so register them together
+        admin, driver = await asyncio.gather(
+            self._check("Admin Registration", "POST", "/api/auth/register",
+                        json_body=admin_data, expect_keys=('token', 'user'), fatal=True),
+            self._check("Driver Registration", "POST", "/api/auth/register",
+                        json_body=driver_data, expect_keys=('token', 'user'), fatal=True)
+        )
+        self._set_users(admin, driver)
+        if TEST_TOKEN_CACHE:
+            try:
+                with open(TEST_TOKEN_CACHE, 'wb') as f:
+                    f.write(orjson.dumps({"admin": admin, "driver": driver}))
+            except OSError as e:
+                self.log(f"⚠️  Could not cache users in {TEST_TOKEN_CACHE}: {e}")
 
+    @_test_case
     async def test_user_login(self):
         """Test user login for both admin and driver"""
         # Since we registered with unique emails, we need to use the same emails for login
         if not self.admin_user or not self.driver_user:
-            self.log_result("User Login", False, "Registration must be completed first")
-            return False
+            raise TestFailed("User Login", "Registration must be completed first")
             
-        # Test admin login
         admin_login = {
             "email": self.admin_user['email'],
             "password": "admin123"
         }
-        
-        try:
-            async with self.session.post(f"{API_BASE}/auth/login", json=admin_login) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'token' in data and data['user']['role'] == 'admin':
-                        self.log_result("Admin Login", True)
-                    else:
-                        self.log_result("Admin Login", False, f"Invalid response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Admin Login", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Admin Login", False, f"Exception: {str(e)}")
-            return False
-
-        # Test driver login
         driver_login = {
             "email": self.driver_user['email'],
             "password": "driver123"
         }
         
-        try:
-            async with self.session.post(f"{API_BASE}/auth/login", json=driver_login) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'token' in data and data['user']['role'] == 'driver':
-                        self.log_result("Driver Login", True)
-                        return True
-                    else:
-                        self.log_result("Driver Login", False, f"Invalid response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Driver Login", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Driver Login", False, f"Exception: {str(e)}")
-            return False
+        await asyncio.gather(
+            self._check("Admin Login", "POST", "/api/auth/login", json_body=admin_login,
+                        expect_keys=('token',), valid=lambda d: d['user']['role'] == 'admin'),
+            self._check("Driver Login", "POST", "/api/auth/login", json_body=driver_login,
+                        expect_keys=('token',), valid=lambda d: d['user']['role'] == 'driver')
+        )
 
+    @_test_case
     async def test_delivery_creation(self):
         """Test delivery creation with automatic geocoding (admin only)"""
-        delivery_data = {
-            "customer_name": "Sarah Johnson",
-            "customer_phone": "+1415555123",
-            "customer_email": "sarah.johnson@example.com",
-            "pickup_address": "Union Square, San Francisco, CA",
-            "delivery_address": "Fisherman's Wharf, San Francisco, CA",
-            "notes": "Handle with care - fragile electronics"
-        }
-        
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        try:
-            async with self.session.post(f"{API_BASE}/deliveries", json=delivery_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'delivery_id' in data and 'pickup_coordinates' in data and 'delivery_coordinates' in data:
-                        self.test_delivery_id = data['delivery_id']
-                        self.log_result("Delivery Creation with Geocoding", True, f"Created delivery with coordinates")
-                        return True
-                    else:
-                        self.log_result("Delivery Creation with Geocoding", False, f"Missing required fields: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Delivery Creation with Geocoding", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Delivery Creation with Geocoding", False, f"Exception: {str(e)}")
-            return False
-
+        data = await self._do("Delivery Creation with Geocoding", "POST", "/api/deliveries",
+                              self.admin_headers, DELIVERY_BODY,
+                              expect_keys=('delivery_id', 'pickup_coordinates', 'delivery_coordinates'),
+                              fatal=True)
+        self.test_delivery_id = data['delivery_id']
+        self.log_result("Delivery Creation with Geocoding", True, f"Created delivery with coordinates")
+
+    @_test_case
     async def test_delivery_listing(self):
         """Test delivery listing for both admin and driver"""
         # Test admin delivery listing
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        try:
-            async with self.session.get(f"{API_BASE}/deliveries", headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'deliveries' in data and isinstance(data['deliveries'], list) and len(data['deliveries']) > 0:
-                        self.log_result("Admin Delivery Listing", True, f"Found {len(data['deliveries'])} deliveries")
-                    else:
-                        self.log_result("Admin Delivery Listing", False, f"Expected deliveries list, got: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Admin Delivery Listing", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Admin Delivery Listing", False, f"Exception: {str(e)}")
-            return False
+        data = await self._do("Admin Delivery Listing", "GET", ADMIN_LISTING_PATH, self.admin_headers,
+                              expect_keys=('deliveries',),
+                              valid=lambda d: isinstance(d['deliveries'], list) and len(d['deliveries']) > 0)
+        self.log_result("Admin Delivery Listing", True, f"Newest delivery: {data['deliveries'][0]['id']}")
 
         # Test driver delivery listing (should be empty initially)
-        headers = {"Authorization": f"Bearer {self.driver_token}"}
-        
-        try:
-            async with self.session.get(f"{API_BASE}/deliveries", headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'deliveries' in data and isinstance(data['deliveries'], list):
-                        self.log_result("Driver Delivery Listing", True, f"Driver sees {len(data['deliveries'])} assigned deliveries")
-                        return True
-                    else:
-                        self.log_result("Driver Delivery Listing", False, f"Expected deliveries list, got: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Driver Delivery Listing", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Driver Delivery Listing", False, f"Exception: {str(e)}")
-            return False
+        data = await self._do("Driver Delivery Listing", "GET", "/api/deliveries", self.driver_headers,
+                              expect_keys=('deliveries',),
+                              valid=lambda d: isinstance(d['deliveries'], list))
+        self.log_result("Driver Delivery Listing", True, f"Driver sees {len(data['deliveries'])} assigned deliveries")
 
+    @_test_case
     async def test_driver_listing(self):
         """Test driver listing (admin only)"""
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        data = await self._do("Driver Listing", "GET", "/api/drivers", self.admin_headers,
+                              expect_keys=('drivers',),
+                              valid=lambda d: isinstance(d['drivers'], list) and len(d['drivers']) > 0)
         
-        try:
-            async with self.session.get(f"{API_BASE}/drivers", headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'drivers' in data and isinstance(data['drivers'], list) and len(data['drivers']) > 0:
-                        # Should find our registered driver
-                        driver_found = any(driver['email'] == self.driver_user['email'] for driver in data['drivers'])
-                        if driver_found:
-                            self.log_result("Driver Listing", True, f"Found {len(data['drivers'])} drivers")
-                            return True
-                        else:
-                            self.log_result("Driver Listing", False, f"Registered driver not found in list: {data}")
-                            return False
-                    else:
-                        self.log_result("Driver Listing", False, f"Expected drivers list, got: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Driver Listing", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Driver Listing", False, f"Exception: {str(e)}")
-            return False
+        # Should find our registered driver
+        emails = {driver['email'] for driver in data['drivers']}
+        if self.driver_user['email'] not in emails:
+            raise TestFailed("Driver Listing", f"Registered driver not found in list: {data}")
+        self.log_result("Driver Listing", True, f"Found {len(data['drivers'])} drivers")
 
+    @_test_case
     async def test_delivery_assignment(self):
         """Test delivery assignment to driver with location support"""
         if not self.test_delivery_id or not self.driver_user:
-            self.log_result("Delivery Assignment", False, "Missing delivery ID or driver user")
-            return False
+            raise TestFailed("Delivery Assignment", "Missing delivery ID or driver user")
 
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        assignment_data = {"driver_id": self.driver_user['id']}
-        
-        try:
-            url = f"{API_BASE}/deliveries/{self.test_delivery_id}/assign"
-            async with self.session.post(url, json=assignment_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'message' in data:
-                        self.log_result("Delivery Assignment", True)
-                        return True
-                    else:
-                        self.log_result("Delivery Assignment", False, f"Unexpected response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Delivery Assignment", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Delivery Assignment", False, f"Exception: {str(e)}")
-            return False
+        await self._check("Delivery Assignment", "POST", ASSIGN_PATH.format(self.test_delivery_id),
+                          self.admin_headers, self.assignment_body, expect_keys=('message',), status_only=True)
 
+    @_test_case
     async def test_delivery_status_updates(self):
         """Test delivery status updates"""
         if not self.test_delivery_id:
-            self.log_result("Delivery Status Updates", False, "Missing delivery ID")
-            return False
+            raise TestFailed("Delivery Status Updates", "Missing delivery ID")
 
-        headers = {"Authorization": f"Bearer {self.driver_token}"}
-        
-        # Test status update to picked_up
-        status_update = {"status": "picked_up"}
-        
-        try:
-            url = f"{API_BASE}/deliveries/{self.test_delivery_id}/status"
-            async with self.session.put(url, json=status_update, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'message' in data:
-                        self.log_result("Status Update (Picked Up)", True)
-                    else:
-                        self.log_result("Status Update (Picked Up)", False, f"Unexpected response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Status Update (Picked Up)", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Status Update (Picked Up)", False, f"Exception: {str(e)}")
-            return False
-
-        # Test status update to in_transit
-        status_update = {"status": "in_transit"}
-        
-        try:
-            url = f"{API_BASE}/deliveries/{self.test_delivery_id}/status"
-            async with self.session.put(url, json=status_update, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'message' in data:
-                        self.log_result("Status Update (In Transit)", True)
-                        return True
-                    else:
-                        self.log_result("Status Update (In Transit)", False, f"Unexpected response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Status Update (In Transit)", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Status Update (In Transit)", False, f"Exception: {str(e)}")
-            return False
+        path = STATUS_PATH.format(self.test_delivery_id)
+        for status, label in (("picked_up", "Picked Up"), ("in_transit", "In Transit")):
+            test_name = f"Status Update ({label})"
+            await self._check(test_name, "PUT", path, self.driver_headers,
+                              STATUS_BODIES[status], expect_keys=('message',), status_only=True)
 
+    @_test_case
     async def test_location_updates(self):
-        """Test location update endpoint"""
-        if not self.test_delivery_id:
-            self.log_result("Location Updates", False, "Missing delivery ID")
-            return False
+        """Test single-location frames pipelined over the driver socket"""
+        if not self.driver_user:
+            raise TestFailed("Location Updates", "Missing driver user")
 
-        headers = {"Authorization": f"Bearer {self.driver_token}"}
-        
-        location_data = {
-            "delivery_id": self.test_delivery_id,
-            "lat": 40.7128,
-            "lng": -74.0060,
+        # There is no HTTP location endpoint; single objects are the socket's non-batched frame shape
+        pickup = SF_COORDINATES["pickup"]
+        locations = [{
+            "latitude": pickup["latitude"] + offset,
+            "longitude": pickup["longitude"],
             "heading": 45.0,
-            "speed": 25.5
-        }
+            "speed": 25.5,
+            "timestamp": self.run_timestamp
+        } for offset in (0.0, 0.001, 0.002)]
         
         try:
-            async with self.session.post(f"{API_BASE}/locations", json=location_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'message' in data:
-                        self.log_result("Location Updates", True)
-                        return True
-                    else:
-                        self.log_result("Location Updates", False, f"Unexpected response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Location Updates", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
+            acks = await asyncio.gather(*[self._send_driver_frame(msgpack.packb(location, use_bin_type=True))
+                                           for location in locations])
         except Exception as e:
-            self.log_result("Location Updates", False, f"Exception: {str(e)}")
-            return False
+            raise TestFailed("Location Updates", f"Exception: {str(e)}") from e
+        if any(ack.get('type') != 'location_ack' or ack.get('count', 1) != 1 for ack in acks):
+            raise TestFailed("Location Updates", f"Unexpected acks: {acks}")
+        self.log_result("Location Updates", True, f"{len(acks)} frames acknowledged")
 
     # ========== NEW MAPBOX INTEGRATION TESTS ==========
 
+    @_test_case
     async def test_route_calculation(self):
         """Test route calculation between coordinates"""
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        route_data = {
-            "origin": SF_COORDINATES["pickup"],
-            "destination": SF_COORDINATES["delivery"],
-            "profile": "mapbox/driving-traffic",
-            "steps": True,
-            "alternatives": True
-        }
-        
-        try:
-            async with self.session.post(f"{API_BASE}/route/calculate", json=route_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success') and 'route' in data and 'duration' in data and 'distance' in data:
-                        self.log_result("Route Calculation", True, f"Route: {data['distance']:.0f}m, {data['duration']:.0f}s")
-                        return True
-                    else:
-                        self.log_result("Route Calculation", False, f"Invalid route response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Route Calculation", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Route Calculation", False, f"Exception: {str(e)}")
-            return False
+        data = await self._do("Route Calculation", "POST", "/api/route/calculate",
+                              self.admin_headers, ROUTE_BODY,
+                              expect_keys=('route', 'duration', 'distance'), valid=SUCCEEDED)
+        self.log_result("Route Calculation", True, f"Route: {data['distance']:.0f}m, {data['duration']:.0f}s")
 
+    @_test_case
     async def test_route_optimization(self):
         """Test multi-stop route optimization"""
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        coordinates = [
-            SF_COORDINATES["pickup"],
-            SF_COORDINATES["waypoint"],
-            SF_COORDINATES["delivery"]
-        ]
-        
-        try:
-            async with self.session.post(f"{API_BASE}/route/optimize", 
-                                       json={"coordinates": coordinates, "profile": "mapbox/driving-traffic"}, 
-                                       headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success') and 'route' in data:
-                        self.log_result("Route Optimization", True, f"Optimized route calculated")
-                        return True
-                    else:
-                        self.log_result("Route Optimization", False, f"Invalid optimization response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Route Optimization", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Route Optimization", False, f"Exception: {str(e)}")
-            return False
+        data = await self._do("Route Optimization", "POST", "/api/route/optimize",
+                              self.admin_headers, OPTIMIZE_BODY,
+                              expect_keys=('route',), valid=SUCCEEDED)
+        self.log_result("Route Optimization", True, f"Optimized route calculated")
 
+    @_test_case
     async def test_geocoding(self):
         """Test address to coordinates conversion"""
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        test_address = "Union Square, San Francisco, CA"
+        data = await self._do("Geocoding", "POST", "/api/geocode",
+                              self.admin_headers, GEOCODE_BODY,
+                              expect_keys=('coordinate',), valid=SUCCEEDED)
         
-        try:
-            async with self.session.post(f"{API_BASE}/geocode", 
-                                       json={"address": test_address}, 
-                                       headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success') and 'coordinate' in data:
-                        coord = data['coordinate']
-                        if 'latitude' in coord and 'longitude' in coord:
-                            self.log_result("Geocoding", True, f"Address geocoded to {coord['latitude']:.4f}, {coord['longitude']:.4f}")
-                            return True
-                        else:
-                            self.log_result("Geocoding", False, f"Invalid coordinate format: {coord}")
-                            return False
-                    else:
-                        self.log_result("Geocoding", False, f"Geocoding failed: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Geocoding", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Geocoding", False, f"Exception: {str(e)}")
-            return False
+        coord = data['coordinate']
+        if 'latitude' not in coord or 'longitude' not in coord:
+            raise TestFailed("Geocoding", f"Invalid coordinate format: {coord}")
+        self.log_result("Geocoding", True, f"Address geocoded to {coord['latitude']:.4f}, {coord['longitude']:.4f}")
 
+    @_test_case
     async def test_reverse_geocoding(self):
         """Test coordinates to address conversion"""
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        coordinate = SF_COORDINATES["pickup"]
-        
-        try:
-            async with self.session.post(f"{API_BASE}/reverse-geocode", 
-                                       json={"coordinate": coordinate}, 
-                                       headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success') and 'address' in data:
-                        self.log_result("Reverse Geocoding", True, f"Coordinates converted to: {data['address'][:50]}...")
-                        return True
-                    else:
-                        self.log_result("Reverse Geocoding", False, f"Reverse geocoding failed: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Reverse Geocoding", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Reverse Geocoding", False, f"Exception: {str(e)}")
-            return False
+        data = await self._do("Reverse Geocoding", "POST", "/api/reverse-geocode",
+                              self.admin_headers, REVERSE_GEOCODE_BODY,
+                              expect_keys=('address',), valid=SUCCEEDED)
+        self.log_result("Reverse Geocoding", True, f"Coordinates converted to: {data['address'][:50]}...")
 
+    @_test_case
     async def test_navigation_start(self):
         """Test starting navigation for a delivery"""
         if not self.test_delivery_id:
-            self.log_result("Navigation Start", False, "Missing delivery ID")
-            return False
+            raise TestFailed("Navigation Start", "Missing delivery ID")
 
-        headers = {"Authorization": f"Bearer {self.driver_token}"}
-        
-        route_data = {
-            "route_id": "test-route-123",
-            "estimated_duration": 1800,  # 30 minutes
-            "estimated_distance": 5000   # 5km
-        }
-        
-        try:
-            url = f"{API_BASE}/delivery/{self.test_delivery_id}/navigation/start"
-            async with self.session.post(url, json=route_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        self.log_result("Navigation Start", True)
-                        return True
-                    else:
-                        self.log_result("Navigation Start", False, f"Navigation start failed: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Navigation Start", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Navigation Start", False, f"Exception: {str(e)}")
-            return False
+        await self._check("Navigation Start", "POST", NAVIGATION_START_PATH.format(self.test_delivery_id),
+                          self.driver_headers, NAVIGATION_START_BODY, valid=SUCCEEDED)
 
+    @_test_case
     async def test_navigation_progress(self):
         """Test updating navigation progress"""
         if not self.test_delivery_id:
-            self.log_result("Navigation Progress", False, "Missing delivery ID")
-            return False
+            raise TestFailed("Navigation Progress", "Missing delivery ID")
 
-        headers = {"Authorization": f"Bearer {self.driver_token}"}
-        
-        progress_data = {
-            "distance_remaining": 2500,
-            "duration_remaining": 900,
-            "fraction_traveled": 0.5,
-            "distance_traveled": 2500,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        try:
-            url = f"{API_BASE}/delivery/{self.test_delivery_id}/progress"
-            async with self.session.post(url, json=progress_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        self.log_result("Navigation Progress", True)
-                        return True
-                    else:
-                        self.log_result("Navigation Progress", False, f"Progress update failed: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Navigation Progress", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Navigation Progress", False, f"Exception: {str(e)}")
-            return False
+        await self._check("Navigation Progress", "POST", PROGRESS_PATH.format(self.test_delivery_id),
+                          self.driver_headers, self.progress_body, valid=SUCCEEDED)
 
+    @_test_case
     async def test_delivery_completion(self):
         """Test completing a delivery"""
         if not self.test_delivery_id:
-            self.log_result("Delivery Completion", False, "Missing delivery ID")
-            return False
+            raise TestFailed("Delivery Completion", "Missing delivery ID")
 
-        headers = {"Authorization": f"Bearer {self.driver_token}"}
-        
-        try:
-            url = f"{API_BASE}/delivery/{self.test_delivery_id}/complete"
-            async with self.session.post(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success'):
-                        self.log_result("Delivery Completion", True)
-                        return True
-                    else:
-                        self.log_result("Delivery Completion", False, f"Completion failed: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Delivery Completion", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Delivery Completion", False, f"Exception: {str(e)}")
-            return False
+        await self._check("Delivery Completion", "POST", COMPLETE_PATH.format(self.test_delivery_id),
+                          self.driver_headers, valid=SUCCEEDED)
 
+    @_test_case
     async def test_driver_location_retrieval(self):
         """Test getting driver location"""
         if not self.driver_user:
-            self.log_result("Driver Location Retrieval", False, "Missing driver user")
-            return False
+            raise TestFailed("Driver Location Retrieval", "Missing driver user")
 
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        try:
-            url = f"{API_BASE}/driver/{self.driver_user['id']}/location"
-            async with self.session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    # Location might not exist yet, so success=false is acceptable
-                    if 'success' in data:
-                        self.log_result("Driver Location Retrieval", True, f"Location status: {data['success']}")
-                        return True
-                    else:
-                        self.log_result("Driver Location Retrieval", False, f"Invalid response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Driver Location Retrieval", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Driver Location Retrieval", False, f"Exception: {str(e)}")
-            return False
+        # Location might not exist yet, so success=false is acceptable
+        data = await self._do("Driver Location Retrieval", "GET", self.driver_location_path,
+                              self.admin_headers, expect_keys=('success',))
+        self.log_result("Driver Location Retrieval", True, f"Location status: {data['success']}")
 
+    @_test_case
     async def test_tracking_link_creation(self):
         """Test creating customer tracking links"""
         if not self.test_delivery_id:
-            self.log_result("Tracking Link Creation", False, "Missing delivery ID")
-            return False
+            raise TestFailed("Tracking Link Creation", "Missing delivery ID")
 
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        
-        tracking_data = {
-            "customer_email": "sarah.johnson@example.com"
-        }
-        
-        try:
-            url = f"{API_BASE}/deliveries/{self.test_delivery_id}/tracking"
-            async with self.session.post(url, json=tracking_data, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('success') and 'tracking_id' in data and 'tracking_url' in data:
-                        self.tracking_id = data['tracking_id']
-                        self.log_result("Tracking Link Creation", True, f"Tracking ID: {self.tracking_id}")
-                        return True
-                    else:
-                        self.log_result("Tracking Link Creation", False, f"Invalid tracking response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Tracking Link Creation", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
-        except Exception as e:
-            self.log_result("Tracking Link Creation", False, f"Exception: {str(e)}")
-            return False
+        data = await self._do("Tracking Link Creation", "POST", TRACKING_LINK_PATH.format(self.test_delivery_id),
+                              self.admin_headers, TRACKING_BODY,
+                              expect_keys=('tracking_id', 'tracking_url'), valid=SUCCEEDED)
+        self.tracking_id = data['tracking_id']
+        self.log_result("Tracking Link Creation", True, f"Tracking ID: {self.tracking_id}")
 
+    @_test_case
     async def test_public_tracking(self):
         """Test public tracking endpoint (no auth required)"""
         if not self.tracking_id:
-            self.log_result("Public Tracking", False, "Missing tracking ID")
-            return False
-
+            raise TestFailed("Public Tracking", "Missing tracking ID")
+
+        data = await self._do("Public Tracking", "GET", TRACK_PATH.format(self.tracking_id),
+                              expect_keys=('delivery_id', 'status', 'pickup_location', 'delivery_location'))
+        self.log_result("Public Tracking", True, f"Tracking data retrieved for delivery {data['delivery_id']}")
+
+    @staticmethod
+    def _should_emit(prev_lat, prev_lng, lat, lng, r0=SHARE_RADIUS_M):
+        """Check whether a position is outside the share radius of the last one sent"""
+        if prev_lat is None:
+            return True
+        dx = (lng - prev_lng) * 111320 * math.cos(math.radians(lat))
+        dy = (lat - prev_lat) * 111320
+        return math.hypot(dx, dy) > r0
+
+    def _trip_batch(self, samples):
+        """Replay a pickup -> delivery trip, keeping only samples outside the share radius"""
+        batch = []
+        pickup, destination = SF_COORDINATES["pickup"], SF_COORDINATES["delivery"]
+        prev_lat = prev_lng = None
+        for step in range(samples + 1):
+            fraction = step / samples
+            lat = pickup["latitude"] + (destination["latitude"] - pickup["latitude"]) * fraction
+            lng = pickup["longitude"] + (destination["longitude"] - pickup["longitude"]) * fraction
+            if not self._should_emit(prev_lat, prev_lng, lat, lng):
+                continue
+            prev_lat, prev_lng = lat, lng
+            batch.append({
+                "latitude": lat,
+                "longitude": lng,
+                "heading": 45.0,
+                "speed": 30.0,
+                "accuracy": 5.0,
+                "timestamp": self.run_timestamp
+            })
+        return batch
+
+    async def _driver_socket(self):
+        """Open the shared driver socket and its ack reader on first use"""
+        async with self.driver_ws_lock:
+            if self.driver_ws is None:
+                # Small frames gain nothing from permessage-deflate
+                self.driver_ws = await ws_connect(
+                    WS_DRIVER_URL.format(self.driver_user['id']),
+                    compression=None,
+                    max_size=2**20
+                )
+                self.driver_ack_reader = self.loop.create_task(self._read_driver_acks(self.driver_ws))
+            return self.driver_ws
+
+    async def _read_driver_acks(self, websocket):
+        """Hand each ack to the oldest waiting sender; the server acks frames in order"""
         try:
-            async with self.session.get(f"{API_BASE}/track/{self.tracking_id}") as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'delivery_id' in data and 'status' in data and 'pickup_location' in data and 'delivery_location' in data:
-                        self.log_result("Public Tracking", True, f"Tracking data retrieved for delivery {data['delivery_id']}")
-                        return True
-                    else:
-                        self.log_result("Public Tracking", False, f"Invalid tracking response: {data}")
-                        return False
-                else:
-                    error_data = await response.text()
-                    self.log_result("Public Tracking", False, f"Status: {response.status}, Response: {error_data}")
-                    return False
+            async for raw in websocket:
+                future = self.pending_acks.popleft()
+                # A sender that timed out still consumes its ack, keeping later acks aligned
+                if not future.done():
+                    future.set_result(msgpack.unpackb(raw, raw=False))
+        except Exception:
+            pass
+        finally:
+            self.driver_ws = None
+            await websocket.close()
+            while self.pending_acks:
+                future = self.pending_acks.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError("Driver socket closed before ack"))
+
+    async def _send_driver_frame(self, frame):
+        """Send one msgpack-encoded frame over the shared driver socket and return its ack"""
+        websocket = await self._driver_socket()
+        # Sends are pipelined; the reader task resolves acks so senders never wait on each other.
+        # The lock only keeps the ack queue in the same order as frames on the wire
+        ack = self.loop.create_future()
+        async with self.driver_send_lock:
+            self.pending_acks.append(ack)
+            await websocket.send(frame)
+        # Binary frames are acknowledged in msgpack
+        return await asyncio.wait_for(ack, timeout=WS_RECV_TIMEOUT)
+
+    async def _send_trip(self, samples):
+        """Send a batched trip over the shared driver socket and return (points sent, ack)"""
+        if samples not in self.trip_frames:
+            batch = self._trip_batch(samples)
+            self.trip_frames[samples] = len(batch), msgpack.packb(batch, use_bin_type=True)
+        sent, frame = self.trip_frames[samples]
+        return sent, await self._send_driver_frame(frame)
+
+    async def _check_driver_socket(self):
+        """Send a trip over the shared driver socket and check its ack"""
+        test_name = "Driver WebSocket Connection"
+        try:
+            sent, response_data = await self._send_trip(TRIP_SAMPLES)
         except Exception as e:
-            self.log_result("Public Tracking", False, f"Exception: {str(e)}")
-            return False
+            return test_name, False, f"Exception: {str(e)}"
+        if response_data.get('type') == 'location_ack' and response_data.get('count', sent) == sent:
+            return test_name, True, f"{sent}/{TRIP_SAMPLES + 1} trip samples in one frame"
+        return test_name, False, f"Unexpected response: {response_data}"
+
+    async def _check_customer_socket(self):
+        """Open a customer tracking socket and check its initial snapshot"""
+        test_name = "Customer WebSocket Connection"
+        if not self.tracking_id:
+            return test_name, False, "No tracking ID available"
+        try:
+            # Open for one frame only, so skip the library's keepalive ping task
+            async with ws_connect(WS_CUSTOMER_URL.format(self.tracking_id), compression=None, max_size=2**20,
+                                  ping_interval=None) as websocket:
+                # Wait for initial data; keep the text frame as bytes, only its leading type is checked
+                initial_data = await asyncio.wait_for(websocket.recv(decode=False), timeout=WS_RECV_TIMEOUT)
+        except Exception as e:
+            return test_name, False, f"Exception: {str(e)}"
+        if initial_data.startswith(INITIAL_DATA_PREFIX):
+            return test_name, True, ""
+        return test_name, True, "Connected but no initial data"
 
+    @_test_case
     async def test_websocket_connections(self):
         """Test WebSocket connections for real-time tracking"""
         if not self.driver_user:
-            self.log_result("WebSocket Connections", False, "Missing driver user")
-            return False
+            raise TestFailed("WebSocket Connections", "Missing driver user")
 
-        # Test driver WebSocket connection
-        ws_url = f"{BACKEND_URL.replace('http', 'ws')}/ws/driver/{self.driver_user['id']}"
-        
+        # The driver and customer sockets are independent, so open them together
+        results = await asyncio.gather(self._check_driver_socket(), self._check_customer_socket())
+        for test_name, ok, message in results:
+            self.log_result(test_name, ok, message)
+
+    async def _expect_status(self, test_name, expected, method, path, headers=None, json_body=None):
+        """Send a request that should fail and check it fails with one of the expected statuses"""
         try:
-            async with websockets.connect(ws_url) as websocket:
-                # Send a test location update via WebSocket
-                test_message = {
-                    "latitude": SF_COORDINATES["pickup"]["latitude"],
-                    "longitude": SF_COORDINATES["pickup"]["longitude"],
-                    "heading": 90.0,
-                    "speed": 30.0,
-                    "accuracy": 5.0,
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                
-                await websocket.send(json.dumps(test_message))
-                
-                # Wait for acknowledgment
-                response = await asyncio.wait_for(websocket.recv(), timeout=5.0)
-                response_data = json.loads(response)
-                
-                if response_data.get('type') == 'location_ack':
-                    self.log_result("Driver WebSocket Connection", True)
-                else:
-                    self.log_result("Driver WebSocket Connection", False, f"Unexpected response: {response_data}")
-                
+            status, _ = await self._request(method, path, headers, json_body, parse=False)
+            if status in expected:
+                return test_name, True, ""
+            return test_name, False, f"Expected {'/'.join(map(str, expected))}, got {status}"
         except Exception as e:
-            self.log_result("Driver WebSocket Connection", False, f"Exception: {str(e)}")
+            return test_name, False, f"Exception: {str(e)}"
+
+    @_test_case
+    async def test_error_handling(self):
+        """Test error handling for invalid requests"""
+        # The three checks share nothing, so send them together
+        results = await asyncio.gather(
+            self._expect_status("Invalid Login Error Handling", (401,), "POST", "/api/auth/login",
+                                json_body=INVALID_LOGIN_BODY),
+            self._expect_status("Unauthorized Access Error Handling", (401, 403), "GET", "/api/deliveries"),
+            self._expect_status("Invalid Delivery ID Error Handling", (404,), "GET", "/api/deliveries/invalid-id",
+                                self.admin_headers)
+        )
+        for test_name, ok, message in results:
+            self.log_result(test_name, ok, message)
+
+    # ========== LOAD TEST ==========
+
+    async def _timed(self, label, method, path, headers=None, json_body=None, parse=True):
+        """Send a request and record its latency under the given step label"""
+        start = time.perf_counter_ns()
+        try:
+            return await self._request(method, path, headers, json_body, parse)
+        finally:
+            self.timings[label].append(time.perf_counter_ns() - start)
 
-        # Test customer WebSocket connection if tracking ID exists
-        if self.tracking_id:
-            customer_ws_url = f"{BACKEND_URL.replace('http', 'ws')}/ws/customer/{self.tracking_id}"
+    async def run_user(self, semaphore, index):
+        """Run one virtual user's delivery lifecycle, returning True if every step succeeded"""
+        async with semaphore:
+            delivery_data = LOAD_DELIVERY_TEMPLATE % (index, index)
             
             try:
-                async with websockets.connect(customer_ws_url) as websocket:
-                    # Wait for initial data
-                    initial_data = await asyncio.wait_for(websocket.recv(), timeout=5.0)
-                    data = json.loads(initial_data)
-                    
-                    if data.get('type') == 'initial_data':
-                        self.log_result("Customer WebSocket Connection", True)
-                        return True
-                    else:
-                        self.log_result("Customer WebSocket Connection", True, "Connected but no initial data")
-                        return True
-                        
+                status, data = await self._timed("create", "POST", "/api/deliveries", self.admin_headers, delivery_data)
+                if status != 200:
+                    return False
+                delivery_id = data['delivery_id']
+                
+                status_path = STATUS_PATH.format(delivery_id)
+                steps = [
+                    ("assign", "POST", ASSIGN_PATH.format(delivery_id), self.admin_headers,
+                     self.assignment_body),
+                    ("status", "PUT", status_path, self.driver_headers, STATUS_BODIES["picked_up"]),
+                    ("status", "PUT", status_path, self.driver_headers, STATUS_BODIES["in_transit"]),
+                    ("navigation_start", "POST", NAVIGATION_START_PATH.format(delivery_id), self.driver_headers,
+                     NAVIGATION_START_BODY),
+                    ("progress", "POST", PROGRESS_PATH.format(delivery_id), self.driver_headers,
+                     self.progress_body)
+                ]
+                for label, method, path, headers, body in steps:
+                    status, _ = await self._timed(label, method, path, headers, body, parse=False)
+                    if status != 200:
+                        return False
+                
+                # Stream the whole trip over the driver socket as one batched frame
+                start = time.perf_counter_ns()
+                _, ack = await self._send_trip(LOAD_TRIP_SAMPLES)
+                self.timings["ws_locations"].append(time.perf_counter_ns() - start)
+                if ack.get('type') != 'location_ack':
+                    return False
+                
+                status, _ = await self._timed("complete", "POST", COMPLETE_PATH.format(delivery_id),
+                                              self.driver_headers, parse=False)
+                return status == 200
             except Exception as e:
-                self.log_result("Customer WebSocket Connection", False, f"Exception: {str(e)}")
+                self.log(f"❌ Virtual user {index}: {str(e)}")
                 return False
-        else:
-            self.log_result("Customer WebSocket Connection", False, "No tracking ID available")
-            return False
 
-    async def test_error_handling(self):
-        """Test error handling for invalid requests"""
-        # Test invalid login
-        invalid_login = {
-            "email": "nonexistent@test.com",
-            "password": "wrongpassword"
-        }
+    async def run_load_test(self, users, concurrency):
+        """Run the delivery lifecycle for many virtual users with bounded concurrency"""
+        self.log(f"🏋️  Load test: {users} users, concurrency {concurrency}, {EVENT_LOOP} loop")
+        self.log("=" * 70)
+        
+        # Size the pool to the concurrency so the connector never becomes the bottleneck
+        await self.setup_session(limit=concurrency * 2, limit_per_host=concurrency * 2)
         
         try:
-            async with self.session.post(f"{API_BASE}/auth/login", json=invalid_login) as response:
-                if response.status == 401:
-                    self.log_result("Invalid Login Error Handling", True)
-                else:
-                    self.log_result("Invalid Login Error Handling", False, f"Expected 401, got {response.status}")
-        except Exception as e:
-            self.log_result("Invalid Login Error Handling", False, f"Exception: {str(e)}")
-
-        # Test unauthorized access
+            await self.test_user_registration()
+            
+            semaphore = asyncio.Semaphore(concurrency)
+            start = time.perf_counter()
+            outcomes = await asyncio.gather(*[self.run_user(semaphore, i) for i in range(users)])
+            elapsed = time.perf_counter() - start
+        except TestAborted as e:
+            self.log(f"⛔ Load test aborted: {e}")
+            return False
+        finally:
+            await self.cleanup_session()
+            self.flush_log()
+        
+        completed = sum(outcomes)
+        self.log(f"\n✅ Completed: {completed}/{users} in {elapsed:.2f}s ({users / elapsed:.1f} users/s)")
+        self.log(f"{'step':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for label, samples in self.timings.items():
+            millis = [sample / 1e6 for sample in samples]
+            if len(millis) > 1:
+                percentiles = statistics.quantiles(millis, n=100)
+                p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+            else:
+                p50 = p95 = p99 = millis[0]
+            self.log(f"{label:<18}{len(millis):>7}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{max(millis):>10.1f}")
+        self.flush_log()
+        
+        return completed == users
+
+    async def _run_stage(self, *tests):
+        """Run independent tests together; an unexpected crash in one cancels the rest of the stage"""
         try:
-            async with self.session.get(f"{API_BASE}/deliveries") as response:
-                if response.status == 401 or response.status == 403:
-                    self.log_result("Unauthorized Access Error Handling", True)
-                else:
-                    self.log_result("Unauthorized Access Error Handling", False, f"Expected 401/403, got {response.status}")
-        except Exception as e:
-            self.log_result("Unauthorized Access Error Handling", False, f"Exception: {str(e)}")
+            async with asyncio.TaskGroup() as tg:
+                for test in tests:
+                    tg.create_task(test)
+        except* TestAborted as group:
+            raise group.exceptions[0]
+        finally:
+            # One write per stage still shows progress on long runs
+            self.flush_log()
 
-        # Test invalid delivery ID
-        headers = {"Authorization": f"Bearer {self.admin_token}"}
-        try:
-            async with self.session.get(f"{API_BASE}/deliveries/invalid-id", headers=headers) as response:
-                if response.status == 404:
-                    self.log_result("Invalid Delivery ID Error Handling", True)
-                    return True
-                else:
-                    self.log_result("Invalid Delivery ID Error Handling", False, f"Expected 404, got {response.status}")
-                    return False
-        except Exception as e:
-            self.log_result("Invalid Delivery ID Error Handling", False, f"Exception: {str(e)}")
-            return False
+    async def _run_in_order(self, *tests):
+        """Run dependent tests one after another as a single entry of a stage"""
+        for test in tests:
+            await test
 
     async def run_all_tests(self):
         """Run all backend tests including Mapbox integration"""
-        print("🚀 Starting Delivery Dispatch Backend Tests with Mapbox Integration")
-        print("=" * 70)
+        self.log(f"🚀 Starting Delivery Dispatch Backend Tests with Mapbox Integration ({EVENT_LOOP} loop)")
+        self.log("=" * 70)
         
         await self.setup_session()
         
         try:
-            # Core functionality tests
-            await self.test_health_check()
-            await self.test_user_registration()
-            await self.test_user_login()
-            
-            # Mapbox route and geocoding tests
-            print("\n🗺️  Testing Mapbox Integration...")
-            await self.test_route_calculation()
-            await self.test_route_optimization()
-            await self.test_geocoding()
-            await self.test_reverse_geocoding()
+            # Core functionality tests; registration fails on its own if the backend is down
+            await self._run_stage(
+                self.test_health_check(),
+                self.test_user_registration(),
+            )
+
+            # Tests below only need the registered users, so run them together
+            self.log("\n🗺️  Testing Mapbox Integration, Delivery Creation & Error Handling...")
+            login_tests = [self.test_user_login()] if TEST_LOGIN_FLOW else []
+            await self._run_stage(
+                *login_tests,
+                self.test_driver_listing(),
+                self.test_route_calculation(),
+                self.test_route_optimization(),
+                self.test_geocoding(),
+                self.test_reverse_geocoding(),
+                self.test_driver_location_retrieval(),
+                self.test_delivery_creation(),
+                self.test_error_handling(),
+            )
             
             # Enhanced delivery management with Mapbox
-            print("\n📦 Testing Enhanced Delivery Management...")
-            await self.test_delivery_creation()
-            await self.test_delivery_listing()
-            await self.test_driver_listing()
-            await self.test_delivery_assignment()
-            await self.test_delivery_status_updates()
+            self.log("\n📦 Testing Enhanced Delivery Management...")
+            # Status updates need the assignment and must stay in order; nothing else waits on them
+            await self._run_stage(
+                self.test_delivery_listing(),
+                self._run_in_order(self.test_delivery_assignment(), self.test_delivery_status_updates()),
+                self.test_tracking_link_creation(),
+            )
             
             # Navigation and tracking tests
-            print("\n🧭 Testing Navigation & Tracking...")
+            self.log("\n🧭 Testing Navigation & Tracking...")
             await self.test_navigation_start()
-            await self.test_navigation_progress()
-            await self.test_driver_location_retrieval()
-            await self.test_tracking_link_creation()
-            await self.test_public_tracking()
-            await self.test_delivery_completion()
-            
-            # Real-time communication tests
-            print("\n🔄 Testing Real-time Communication...")
+            await self._run_stage(
+                self.test_navigation_progress(),
+                self.test_public_tracking(),
+                self.test_location_updates(),
+            )
+            # The customer socket only gets a snapshot once progress or a location is stored, so it goes last
             await self.test_websocket_connections()
+            await self.test_delivery_completion()
             
-            # Error handling tests
-            print("\n⚠️  Testing Error Handling...")
-            await self.test_error_handling()
-            
+        except TestAborted as e:
+            self.log(f"\n⛔ Skipping remaining tests after fatal failure: {e}")
         finally:
             await self.cleanup_session()
+            self.flush_log()
         
-        # Print summary
-        print("\n" + "=" * 70)
-        print("🏁 Test Summary")
-        print("=" * 70)
-        print(f"✅ Passed: {self.results['passed']}")
-        print(f"❌ Failed: {self.results['failed']}")
+        passed, failed = self.passed, len(self.errors)
+        total = passed + failed
+        success_rate = (passed / total) * 100 if total > 0 else 0
         
-        if self.results['errors']:
-            print("\n🔍 Failed Tests:")
-            for error in self.results['errors']:
-                print(f"  • {error}")
+        errors = [f"{test_name}: {message}" for test_name, message in self.errors]
+        summary = {'passed': passed, 'failed': failed, 'errors': errors, 'success_rate': round(success_rate, 1)}
+        if TEST_RESULTS_PATH:
+            with open(TEST_RESULTS_PATH, 'wb') as f:
+                f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
         
-        success_rate = (self.results['passed'] / (self.results['passed'] + self.results['failed'])) * 100 if (self.results['passed'] + self.results['failed']) > 0 else 0
-        print(f"\n📊 Success Rate: {success_rate:.1f}%")
+        if self.json_summary:
+            # One machine-readable line for CI instead of the human summary
+            sys.stdout.buffer.write(orjson.dumps(summary, option=orjson.OPT_APPEND_NEWLINE))
+            sys.stdout.buffer.flush()
+            return failed == 0
         
-        return self.results['failed'] == 0
+        # Print summary
+        lines = [
+            "",
+            "=" * 70,
+            "🏁 Test Summary",
+            "=" * 70,
+            f"✅ Passed: {passed}",
+            f"❌ Failed: {failed}"
+        ]
+        if errors:
+            lines.append("\n🔍 Failed Tests:")
+            lines.extend(f"  • {error}" for error in errors)
+        lines.append(f"\n📊 Success Rate: {success_rate:.1f}%\n")
+        sys.stdout.write("\n".join(lines))
+        sys.stdout.flush()
+        
+        return failed == 0
 
-async def main():
+async def main(users=0, concurrency=10, json_summary=False, verbose=False):
     """Main test runner"""
-    tester = DeliveryDispatchTester()
+    tester = DeliveryDispatchTester(json_summary, verbose or not json_summary)
+    if users:
+        return 0 if await tester.run_load_test(users, concurrency) else 1
+    
     success = await tester.run_all_tests()
     
+    if json_summary:
+        return 0 if success else 1
     if success:
         print("\n🎉 All tests passed! Backend with Mapbox integration is working correctly.")
         return 0
@@ -890,6 +986,18 @@ async def main():
         return 1
 
 if __name__ == "__main__":
-    import sys
-    result = asyncio.run(main())
-    sys.exit(result)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Delivery Dispatch backend tests")
+    parser.add_argument("--users", type=int, default=0,
+                        help="run the delivery lifecycle for this many virtual users instead of the functional tests")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="maximum number of virtual users in flight at once")
+    parser.add_argument("--json", action="store_true",
+                        help="print only a one-line JSON summary of the functional tests")
+    parser.add_argument("--verbose", action="store_true",
+                        help="keep the per-test lines alongside the --json summary")
+    args = parser.parse_args()
+    
+    loop_factory = uvloop.new_event_loop if EVENT_LOOP == 'uvloop' else None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        result = runner.run(main(args.users, max(1, args.concurrency), args.json, args.verbose))
+    sys.exit(result)
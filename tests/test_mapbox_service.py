@@ -0,0 +1,205 @@
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("MAPBOX_ACCESS_TOKEN", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import mapbox_service as ms  # noqa: E402
+from mapbox_service import Coordinate, MapboxService  # noqa: E402
+
+
+TOLERANCE_METERS = 100
+# Points this close to the tolerance may legitimately differ between equirectangular and Haversine
+BOUNDARY_MARGIN_METERS = 1
+
+
+@pytest.fixture(params=[True, False], ids=["kernel", "numpy"])
+def service(request, monkeypatch):
+    """MapboxService checking routes through the (numba or plain) kernel or the NumPy fallback"""
+    monkeypatch.setattr(ms, "NUMBA_AVAILABLE", request.param)
+    return MapboxService()
+
+
+def baseline_on_route(service, location, geometry, tolerance_meters=TOLERANCE_METERS):
+    """Original per-vertex Haversine loop"""
+    for lon, lat in geometry["coordinates"]:
+        if service.calculate_distance(location, Coordinate(longitude=lon, latitude=lat)) <= tolerance_meters:
+            return True
+    return False
+
+
+def nearest_distance(service, location, geometry):
+    return min(
+        service.calculate_distance(location, Coordinate(longitude=lon, latitude=lat))
+        for lon, lat in geometry["coordinates"]
+    )
+
+
+def random_route(rng, lon, lat, points=400, step_meters=25):
+    """Random walk starting at lon/lat, wrapping longitudes into [-180, 180)"""
+    coordinates = []
+    heading = rng.uniform(0, 2 * math.pi)
+    for _ in range(points):
+        coordinates.append([(lon + 180) % 360 - 180, lat])
+        heading += rng.normal(0, 0.3)
+        dlat = step_meters * math.cos(heading) / 111195
+        lat = max(-89.999, min(89.999, lat + dlat))
+        lon += step_meters * math.sin(heading) / (111195 * max(math.cos(math.radians(lat)), 1e-3))
+    return {"type": "LineString", "coordinates": coordinates}
+
+
+def assert_matches_baseline(service, geometry, locations, delivery_id=None):
+    checked = 0
+    for location in locations:
+        if abs(nearest_distance(service, location, geometry) - TOLERANCE_METERS) <= BOUNDARY_MARGIN_METERS:
+            continue
+        expected = baseline_on_route(service, location, geometry)
+        assert service.is_location_on_route(location, geometry, TOLERANCE_METERS, delivery_id) == expected, location
+        checked += 1
+    assert checked
+
+
+def nearby_locations(rng, geometry, count=150, spread_meters=300):
+    """Locations scattered around random route vertices, both on and off the route"""
+    coordinates = geometry["coordinates"]
+    locations = []
+    for i in rng.integers(0, len(coordinates), count):
+        lon, lat = coordinates[i]
+        dlat = rng.uniform(-spread_meters, spread_meters) / 111195
+        dlon = rng.uniform(-spread_meters, spread_meters) / (111195 * max(math.cos(math.radians(lat)), 1e-3))
+        lat = max(-90.0, min(90.0, lat + dlat))
+        locations.append(Coordinate(longitude=(lon + dlon + 180) % 360 - 180, latitude=lat))
+    return locations
+
+
+@pytest.mark.parametrize("lon, lat", [
+    (0.0, 0.0),
+    (-73.98, 40.75),
+    (151.2, -33.87),
+    (18.95, 69.65),
+    (15.6, 81.5),
+    (-40.0, -85.0),
+    (120.0, 89.99),
+    (179.995, 12.0),
+    (-179.995, -45.0),
+])
+def test_is_location_on_route_matches_baseline(service, lon, lat):
+    rng = np.random.default_rng(0)
+    geometry = random_route(rng, lon, lat)
+    assert_matches_baseline(service, geometry, nearby_locations(rng, geometry))
+
+
+def test_is_location_on_route_at_grid_cell_boundaries(service):
+    # Vertices sit exactly on cell edges; probes step across the edges on both axes
+    cell = ms.ROUTE_GRID_CELL_DEG
+    geometry = {
+        "type": "LineString",
+        "coordinates": [[round(k * cell, 6), round(m * cell, 6)] for k in range(-6, 7) for m in (-3, 3)],
+    }
+    locations = []
+    for k in range(-6, 7):
+        for offset_meters in (-150, -99.5, -50, -0.01, 0.0, 0.01, 50, 99.5, 150):
+            lon = k * cell + offset_meters / 111195
+            locations.append(Coordinate(longitude=lon, latitude=3 * cell))
+            locations.append(Coordinate(longitude=lon, latitude=-3 * cell + offset_meters / 111195))
+    assert_matches_baseline(service, geometry, locations)
+
+
+def test_is_location_on_route_across_antimeridian(service):
+    # Route ends just short of +180; probes just past -180 are only metres away
+    geometry = {
+        "type": "LineString",
+        "coordinates": [[179.9 + i * 0.0002, -16.8] for i in range(500)],
+    }
+    locations = [
+        Coordinate(longitude=lon, latitude=-16.8 + dlat)
+        for lon in (179.9995, 180.0, -180.0, -179.9995, -179.999)
+        for dlat in (0.0, 0.0005, 0.002)
+    ]
+    assert_matches_baseline(service, geometry, locations)
+    assert service.is_location_on_route(Coordinate(longitude=-179.9995, latitude=-16.8), geometry)
+
+
+def test_is_location_on_route_across_pole(service):
+    # Route passes the pole; probes on the far side of it are still within tolerance
+    geometry = {
+        "type": "LineString",
+        "coordinates": [[lon, 89.9995] for lon in range(-180, 180, 3)] + [[lon, 89.95 + i * 0.0001] for i, lon in enumerate(range(0, 400))],
+    }
+    geometry["coordinates"] = [[(lon + 180) % 360 - 180, lat] for lon, lat in geometry["coordinates"]]
+    locations = [Coordinate(longitude=lon, latitude=lat) for lon in (-170.0, -45.0, 0.5, 90.0) for lat in (89.999, 89.9992, 89.998, 89.99)]
+    assert_matches_baseline(service, geometry, locations)
+
+
+def test_route_index_cached_per_delivery(service):
+    rng = np.random.default_rng(7)
+    geometry = random_route(rng, 2.35, 48.85)
+    location = Coordinate(longitude=geometry["coordinates"][10][0], latitude=geometry["coordinates"][10][1])
+
+    assert service.is_location_on_route(location, geometry, delivery_id="d1")
+    assert "d1" in service._route_arrays
+
+    # Until forgotten, the delivery keeps its original index even if handed a new geometry
+    moved = random_route(rng, -0.12, 51.5)
+    assert service.is_location_on_route(location, moved, delivery_id="d1")
+    service.forget_route("d1")
+    assert not service.is_location_on_route(location, moved, delivery_id="d1")
+
+    service.is_location_on_route(location, geometry)
+    assert list(service._route_arrays) == ["d1"]
+
+
+def assert_round_trip(original, decoded):
+    assert decoded["type"] == original["type"]
+    error = np.abs(np.asarray(decoded["coordinates"]) - np.asarray(original["coordinates"]))
+    assert error.max() <= ms.COORDINATE_SCALE + 1e-12
+
+
+@pytest.mark.parametrize("lon, lat", [(0.0, 0.0), (-122.42, 37.77), (174.78, -41.29), (179.995, 12.0)])
+def test_quantize_line_string_round_trip(lon, lat):
+    rng = np.random.default_rng(1)
+    geometry = random_route(rng, lon, lat, points=250)
+    geometry["coordinates"] = (np.asarray(geometry["coordinates"]) + rng.uniform(-1e-7, 1e-7, (250, 2))).tolist()
+
+    quantized = ms.quantize_line_string(geometry)
+    assert "coordinates" not in quantized
+    assert_round_trip(geometry, ms.dequantize_line_string(quantized))
+
+
+@pytest.mark.parametrize("points", [0, 1, 2, 7])
+def test_quantize_line_string_keeps_short_lines(points):
+    geometry = {"type": "LineString", "coordinates": [[13.4 + i * 1e-4, 52.5] for i in range(points)]}
+    assert ms.quantize_line_string(geometry) is geometry
+    assert ms.dequantize_line_string(geometry) is geometry
+
+
+def test_map_line_strings_round_trips_nested_step_geometries():
+    rng = np.random.default_rng(2)
+    route = {
+        "geometry": random_route(rng, -0.12, 51.5, points=40),
+        "distance": 1234.5,
+        "legs": [
+            {
+                "steps": [
+                    {"geometry": random_route(rng, -0.12, 51.5, points=12), "maneuver": {"location": [-0.12, 51.5]}},
+                    {"geometry": {"type": "LineString", "coordinates": [[-0.121, 51.501], [-0.122, 51.502]]}},
+                ]
+            }
+        ],
+    }
+
+    quantized = ms.map_line_strings(route, ms.quantize_line_string)
+    assert "offsets" in quantized["geometry"]
+    assert "offsets" in quantized["legs"][0]["steps"][0]["geometry"]
+    assert quantized["legs"][0]["steps"][1]["geometry"] == route["legs"][0]["steps"][1]["geometry"]
+    assert quantized["legs"][0]["steps"][0]["maneuver"] == {"location": [-0.12, 51.5]}
+
+    decoded = ms.map_line_strings(quantized, ms.dequantize_line_string)
+    assert decoded["distance"] == route["distance"]
+    assert_round_trip(route["geometry"], decoded["geometry"])
+    for original_step, decoded_step in zip(route["legs"][0]["steps"], decoded["legs"][0]["steps"]):
+        assert_round_trip(original_step["geometry"], decoded_step["geometry"])
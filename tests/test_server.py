@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+import uuid
+
+import httpx
+import orjson
+import pytest
+from starlette.background import BackgroundTasks
+
+os.environ.setdefault("MAPBOX_ACCESS_TOKEN", "test")
+os.environ.setdefault("DB_NAME", "delivery_dispatch_test")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import server  # noqa: E402
+
+
+ADMIN = {"_id": "test-admin", "role": "admin", "email": "admin@example.com"}
+
+
+async def require_services():
+    """Skip unless the Redis and MongoDB instances the server talks to are reachable"""
+    try:
+        await server.redis_client.ping()
+        await server.client.admin.command("ping")
+    except Exception as e:
+        pytest.skip(f"Redis and MongoDB are required: {e}")
+
+
+async def check_deferred_redis_writes():
+    await require_services()
+    redis = server.redis_client
+    delivery_id = uuid.uuid4().hex
+    await server.db.deliveries.insert_one({"_id": delivery_id, "status": "assigned", "customer_name": "Test"})
+    server.app.dependency_overrides[server.get_current_user] = lambda: ADMIN
+
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            # Background tasks finish before the ASGI call returns, so the writes are visible here
+            response = await http.post(f"/api/deliveries/{delivery_id}/tracking", json={"customer_email": "sarah@example.com"})
+            assert response.status_code == 200
+            tracking_id = response.json()["tracking_id"]
+            metadata = await redis.get(f"tracking_meta:{tracking_id}")
+            assert metadata is not None
+            assert orjson.loads(metadata)["delivery_id"] == delivery_id
+
+            route = {"geometry": {"type": "LineString", "coordinates": [[-122.4194, 37.7749], [-122.4094, 37.7849]]}}
+            response = await http.post(f"/api/delivery/{delivery_id}/navigation/start", json=route)
+            assert response.status_code == 200
+            assert orjson.loads(await redis.get(f"navigation_route:{delivery_id}")) == route
+
+            await redis.setex(f"navigation_progress:{delivery_id}", 600, b"progress")
+            response = await http.post(f"/api/delivery/{delivery_id}/complete")
+            assert response.status_code == 200
+            assert await redis.exists(f"navigation_route:{delivery_id}", f"navigation_progress:{delivery_id}") == 0
+    finally:
+        server.app.dependency_overrides.clear()
+        await server.db.deliveries.delete_one({"_id": delivery_id})
+        await redis.delete(f"navigation_route:{delivery_id}", f"navigation_progress:{delivery_id}")
+        await redis.aclose()
+
+
+def test_deferred_redis_writes_reach_redis():
+    asyncio.run(check_deferred_redis_writes())
+
+
+class RecordingRedis:
+    """Records setex calls, either synchronously or from a returned coroutine"""
+
+    def __init__(self, is_async):
+        self.is_async = is_async
+        self.calls = []
+
+    def setex(self, *args):
+        if not self.is_async:
+            self.calls.append(args)
+            return True
+
+        async def run():
+            self.calls.append(args)
+            return True
+        return run()
+
+
+@pytest.mark.parametrize("is_async", [True, False], ids=["async", "sync"])
+def test_defer_redis_command_runs_for_either_client_type(monkeypatch, is_async):
+    client = RecordingRedis(is_async)
+    monkeypatch.setattr(server, "redis_client", client)
+    tasks = BackgroundTasks()
+    server.defer_redis_command(tasks, "setex", "key", 60, b"value")
+
+    asyncio.run(tasks())
+    assert client.calls == [("key", 60, b"value")]